@@ -15,6 +15,9 @@ It take the default values of parameters from sumo22.
 # true_y0 = torch.tensor([[49.1, 88.9, 72.1, 320.7, 2352., 56.3, 357, 2, 0, 62.0, 7.4, 9.88, 0.012, 0, 65]])
 # true_y0 = torch.tensor([[25.6, 35.8, 18.4, 126.1, 1346., 68.6, 321, 2, 0, 21.0, 1.2, 5.75, 0.004, 0, 29]])
 
+Several scenarios are integrated together in one solver run by stacking them, e.g. all five above as a (5, 15)
+true_y0, optionally with one kinetic parameter set per scenario as a (5, 16) kineP. The returned true_y and
+true_dy then have dimension (data_size, 5, 15); a single (1, 15) initial condition gives (data_size, 1, 15) as before.
 """
 
 import torch
@@ -22,34 +25,61 @@ import numpy as np
 from mechanistic_model import mechanisticODE
 from default_stoichiometric_kinetic_value import default_stoichimetric_kinetic_value
 
-from torchdiffeq import odeint
-# from torchdiffeq import odeint_adjoint as odeint # for adjoint method!
+from ode_solver import ode_solver, solver_tolerances
+from data_cache import cached_result
+from dataset_io import save_dataset
 
 def IVP_data_generation(data_size = 1000, t_span = 0.25, 
     t_y_name = ['time','S_I', 'S_S', 'X_I', 'X_S', 'X_BH', 'X_BA', 'X_P', 'S_O', 'S_NO', 'S_NH', 'S_ND', 'X_ND', 'S_ALK', 'S_N2', 'X_INORG'],
     true_y0 = torch.tensor([[20.2, 59.8, 58.8, 260.1, 2552.0, 148, 449, 2, 0, 23.0, 1.8, 7.8, 0.007, 0, 35]]),
-    save_csv=False):
+    save_csv=False, kineP=None, solver='dopri5', rtol=None, atol=None, cache=False, save_path=None):
 
     noFeature = true_y0.size(dim=true_y0.ndim-1)
+    # one scenario per initial condition, integrated as a batch of (S, 1, noFeature)
+    true_y0 = true_y0.reshape(-1, 1, noFeature)
+    noScenario = true_y0.size(dim=0)
 
     t = torch.linspace(0., t_span, data_size)
+    # the tolerances of the solver (default: None, its own, see solver_tolerances())
+    rtol, atol = solver_tolerances(solver, rtol, atol)
 
     # Generating training data from mechanistic ODEs without autograd
     # print("Generating data.")
-    stoiP, kineP, contunity_check = default_stoichimetric_kinetic_value()
-    with torch.no_grad():
-        model_mechanistic = mechanisticODE(noFeature, kineP, stoiP)
-        true_y = odeint(model_mechanistic, true_y0, t, method='dopri5')
-        
-        true_dy =torch.zeros_like(true_y)
-        for i in range(data_size):
-            true_dy[i,:,:] = model_mechanistic(t,true_y[i,:,:])
-    print("Data generated.")
+    stoiP, default_kineP, contunity_check = default_stoichimetric_kinetic_value()
+    if kineP is None:
+        kineP = default_kineP
+    if kineP.ndim > 1 and kineP.size(dim=0) != noScenario:
+        raise ValueError("Number of kinetic parameter sets does not match number of initial conditions!")
+
+    def generate():
+        with torch.no_grad():
+            model_mechanistic = mechanisticODE(noFeature, kineP, stoiP)
+            # the implicit solver='rosenbrock23' (order 2) beats dopri5 at loose tolerances only, e.g. rtol=1e-4
+            true_y = ode_solver(model_mechanistic, true_y0, t, method=solver, rtol=rtol, atol=atol).view(data_size, noScenario, noFeature)
+
+            # derivatives of all time points and scenarios in one batched evaluation
+            true_dy = model_mechanistic(t, true_y).view(data_size, noScenario, noFeature)
+        print("Data generated.")
+        return true_y, true_dy
+
+    # with cache=True, the same initial conditions, parameters, time grid, solver and tolerances are generated only once
+    if cache:
+        true_y, true_dy = cached_result(generate, 'IVP_data_generation', true_y0, kineP, stoiP, t, solver, rtol, atol)
+    else:
+        true_y, true_dy = generate()
 
     if save_csv:
-        save_y = torch.hstack((t.unsqueeze(-1),torch.squeeze(true_y))).numpy()
-        save_dy = torch.hstack((t.unsqueeze(-1),torch.squeeze(true_dy))).numpy()
-        np.savetxt(fname='ASM_CSTR/ASM1_NODE_package/data/true_y.csv', X=save_y, fmt='%.6f', delimiter=',', header=','.join(t_y_name), comments='')
-        np.savetxt(fname='ASM_CSTR/ASM1_NODE_package/data/true_dy.csv', X=save_dy, fmt='%.6f', delimiter=',', header=','.join(t_y_name), comments='')
+        for s in range(noScenario):
+            suffix = '' if noScenario == 1 else '_%d' % s
+            save_y = torch.hstack((t.unsqueeze(-1), true_y[:, s, :])).numpy()
+            save_dy = torch.hstack((t.unsqueeze(-1), true_dy[:, s, :])).numpy()
+            np.savetxt(fname='ASM_CSTR/ASM1_NODE_package/data/true_y%s.csv' % suffix, X=save_y, fmt='%.6f', delimiter=',', header=','.join(t_y_name), comments='')
+            np.savetxt(fname='ASM_CSTR/ASM1_NODE_package/data/true_dy%s.csv' % suffix, X=save_dy, fmt='%.6f', delimiter=',', header=','.join(t_y_name), comments='')
+
+    # binary dataset in full precision, read back by load_data(save_path)
+    if save_path is not None:
+        save_dataset(save_path, metadata={'true_y0': true_y0.view(noScenario, noFeature), 'kineP': kineP, 'stoiP': stoiP, 'solver': solver,
+                     'rtol': rtol, 'atol': atol},
+                     t=t, true_y=true_y, true_dy=true_dy)
 
-    return t, true_y, true_dy
\ No newline at end of file
+    return t, true_y, true_dy
@@ -1,10 +1,11 @@
+import torch
 import torch.nn as nn
 
 ### Define NODE model ###
 
 class neuralODE(nn.Module):
 
-    def __init__(self, nf, m, s, dm, ds, mx, mn, dmx, dmn, yts):
+    def __init__(self, nf, m, s, dm, ds, mx, mn, dmx, dmn, yts, norm='zscore', width=50):
         super(neuralODE, self).__init__()
         self.nf = nf
         self.ymu = m
@@ -17,17 +18,22 @@ class neuralODE(nn.Module):
         self.dymin = dmn
         self.ytscale = yts
 
+        # normalisation mode: 'none', 'zscore', 'minmax' or 'eqscale', see normalisation()
+        self.norm = norm
+        self.normalisation()
+
+        # width: number of neurons of the hidden layers
         self.net = nn.Sequential(
-            nn.Linear(self.nf, 50),
+            nn.Linear(self.nf, width),
             # nn.Tanh(),
             nn.GELU(),
-            nn.Linear(50, 50),
+            nn.Linear(width, width),
             # nn.Tanh(),
             nn.GELU(),
-            nn.Linear(50, 50),
+            nn.Linear(width, width),
             # nn.Tanh(),
             nn.GELU(),
-            nn.Linear(50, self.nf))
+            nn.Linear(width, self.nf))
 
         for m in self.net.modules():
             if isinstance(m, nn.Linear):
@@ -35,25 +41,38 @@ class neuralODE(nn.Module):
 
     def forward(self, t, y):
 
-        # choose the methods: direct, standardisation, max-min normalisation, or equation scaling
-        # direct output, without normalisation
-        # y = self.net(y)
-
-        # z-score standardisation
-        y = (y - self.ymu) / self.ystd   
+        # the normalisation chosen by norm, as the affine maps set up by normalisation()
+        if self.in_scale is not None:
+            y = (y - self.in_shift) * self.in_scale
         y = self.net(y)
-        y = y * self.dystd + self.dymu
+        if self.out_scale is not None:
+            y = y * self.out_scale + self.out_shift
 
-        # max-min normalisation
-        # ymax_ymin = self.ymax - self.ymin
-        # y[:, ymax_ymin == 0.0] = 0.0
-        # y[:, ymax_ymin != 0.0] = (y[:, ymax_ymin != 0.0] - self.ymin[ymax_ymin != 0]) / ymax_ymin[ymax_ymin != 0]
-        # y = self.net(y)
-        # y = y * (self.dymax - self.dymin) + self.dymin
+        return y
 
-        # equation scaling, refer to Kim:"stiff neural ordinary equations"
-        # loss function must be matched with dividend : /yscale
-        # y = self.net(y) 
-        # y = y * self.ytscale
+    def normalisation(self):
+        """
+        Sets up the normalisation chosen by self.norm as an affine map of the input,
+        (y - in_shift) * in_scale, and of the output of the net, y * out_scale + out_shift.
+        None stands for the identity, so it costs nothing during the solve.
 
-        return y
\ No newline at end of file
+        norm:
+            'none': direct output, without normalisation.
+            'zscore': z-score standardisation.
+            'minmax': max-min normalisation, constant features are fed as 0.0.
+            'eqscale': equation scaling, refer to Kim:"stiff neural ordinary equations";
+                the loss function must be matched with dividend: /ytscale.
+        """
+        self.in_shift, self.in_scale, self.out_scale, self.out_shift = None, None, None, None
+        if self.norm == 'zscore':
+            self.in_shift, self.in_scale = self.ymu, 1.0 / self.ystd
+            self.out_scale, self.out_shift = self.dystd, self.dymu
+        elif self.norm == 'minmax':
+            ymax_ymin = self.ymax - self.ymin
+            self.in_shift = self.ymin
+            self.in_scale = torch.where(ymax_ymin == 0.0, torch.zeros_like(ymax_ymin), 1.0 / ymax_ymin)
+            self.out_scale, self.out_shift = self.dymax - self.dymin, self.dymin
+        elif self.norm == 'eqscale':
+            self.out_scale, self.out_shift = self.ytscale, torch.zeros_like(self.ytscale)
+        elif self.norm != 'none':
+            raise ValueError("Wrong normalisation mode!")
@@ -1,119 +1,69 @@
-import torch
-import numpy as np
-from torchdiffeq import odeint
-# from torchdiffeq import odeint_adjoint as odeint # for adjoint method!
-
-def NODE_training(t, true_y, model, n_iters=2000, batch_time=16, batch_size=512):
-
-    # Training initialization
-    ilr = 1e-1  # learning rate
-    # lr_adjust = { 2: 5e-5, 4: 1e-5, 6: 5e-6, 8: 1e-6,
-    #     10: 5e-7, 15: 1e-7, 20: 5e-8 }
-    gamma = 0.5
-    lr_adjust = {int(0.2 * n_iters): gamma * ilr, int(0.4 * n_iters): gamma ** 2 * ilr, int(0.5 * n_iters): gamma ** 3 * ilr, int(0.6 * n_iters): gamma ** 4 * ilr,
-                int(0.7 * n_iters): gamma ** 5 * ilr, int(0.8 * n_iters): gamma ** 6 * ilr, int(0.9 * n_iters): gamma ** 7 * ilr}
-    # lr_adjust = {int(0.2 * n_iters): gamma * ilr, int(0.8 * n_iters): gamma ** 2 * ilr}
-    # print(lr_adjust)
-    optimizer = torch.optim.Adam(model.parameters(), lr=ilr)
-    # scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=15, gamma=0.1)  # optional learning rate scheduler
-
-    loss_list = []  # record loss data
-    lr_list = []  # record learning rate data
-    show_all_loss = False
-
-    grad_norm = []
-
-    # Define the loss function: Mean Squared Error
-    # The sum of the squares of the differences between prediction and ground truth
-    loss_mse = torch.nn.MSELoss(reduction='mean')
-
-    # Define a Huber Loss Parameter: Delta
-    delta_loss = 0.03
-
-    # Train iteration
-    print("Starting NODE training.")
-
-    for it in range(1, n_iters + 1):
-        model.train(mode=True)
-        optimizer.zero_grad()
-        batch_y0, batch_t, batch_y = get_batch(batch_time, batch_size, true_y, t)
-        # print('batch_y0, batch_t batch_y size:===', batch_y0.size(),batch_t.size(),batch_y.size())
-
-        # torchDiffEq provided solvers
-        pred_y = odeint(model, batch_y0, batch_t, method='dopri5')  # you can change solver here
-
-        # SciPy solver
-        # pred_y = odeint(model, batch_y0, batch_t, method='scipy_solver', options={"solver": "BDF"})
-
-        # Stable solver (need to extend the torchdiffeq package!)
-        # pred_y, error_dopri5, error_dopri8, error_ssolver = odeint(model, batch_y0, batch_t, method='ssolver')
-
-        # define a weighted loss function，also called MAPE (mean absolute percentage error)
-        # mask = batch_y != 0
-        # loss = torch.mean(torch.abs((pred_y[mask] - batch_y[mask])/batch_y[mask]))
-
-        # define RMSE as the loss function (L2)
-        # loss = torch.sqrt(loss_mse(pred_y, batch_y))
-
-        # define MAE as the loss function (L1)
-        loss = torch.mean(torch.abs(pred_y - batch_y))
-        # loss_L1 = nn.L1Loss(reduction='mean')
-        # loss = loss_L1(pred_y, batch_y)
-            
-        # define MAE with scaling, refer to Kim: "stiff NODEs"
-        # loss = torch.mean(torch.abs(pred_y / yScale - batch_y / yScale))
-        # loss_L1 = nn.L1Loss(reduction='mean')
-        # loss = loss_L1(pred_y / yScale, batch_y / yScale)
-
-        # define MSE as the loss function
-        # loss = loss_mse(pred_y, batch_y)
-
-        # define a Huber loss function
-        # loss = torch.mean(torch.where(torch.abs(pred_y - batch_y) < delta_loss, 0.5 * ((pred_y - batch_y) ** 2), delta_loss * torch.abs(pred_y - batch_y) - 0.5 * (delta_loss ** 2)))
-
-        # define a log cosh loss function
-        # loss = torch.mean(torch.log(torch.cosh(pred_y - batch_y)))
-
-        loss.backward()
-
-        loss_list.append(loss.item())
-        lr_list.append(optimizer.param_groups[-1]['lr'])
-
-        # ========================== gradient norm ==================
-        total_norm = 0.0
-        for p in model.parameters():
-            param_norm = p.grad.detach().data.norm(2)
-            total_norm += param_norm.item() ** 2
-        total_norm = total_norm ** 0.5
-        # print(total_norm)
-        grad_norm.append(total_norm)
-
-        # ==========================gradient norm end ==============
-
-        optimizer.step()
-        # scheduler.step()
-
-        # ====================adjust lr========================
-
-        if it in lr_adjust.keys():
-            lr = lr_adjust[it]
-            for param_group in optimizer.param_groups:
-                param_group['lr'] = lr
-            # print('Updating learning rate to {}'.format(lr))
-
-        if show_all_loss:
-            print('Iter {:04d} | Loss {:.7f}'.format(it, loss.item()))
-            # plot_loss(loss_list)
-        else:
-            if it % 250 == 0:
-                print('Iteration: ', it, '/', n_iters)
+from ode_solver import ode_solver
+from batch_sampler import windowSampler
+from solver_stats import instrumentedODE, stiffness_ratio, forwardSavedMemory
+from training_engine import training_engine
+from regularisation import regularisation_penalty
+
+def NODE_training(t, true_y, model, n_iters=2000, batch_time=16, batch_size=512, solver='dopri5', rtol=None, atol=None, sampler=None,
+    solver_stats=False, stiffness=False, gradient='direct', adjoint_method=None, adjoint_options=None, n_segments=4,
+    patience=None, min_delta=1e-2, tol=0.0, log_path=None, loss='mae', loss_options=None, scheduler='step', scheduler_options=None,
+    validation_fn=None, target_rmse=None, validate_every=100, regulariser=None, reg_weight=None, ilr=1e-1):
+
+    # the loss (default: MAE), the learning rate schedule (default: halving from ilr at fixed fractions of n_iters)
+    # and early stopping on a loss plateau (patience) or on the validation RMSE (validation_fn, target_rmse),
+    # see training_engine()
+
+    # regulariser: 'jacobian', 'kinetic' or 'taylor' adds reg_weight times the penalty of the vector field at the
+    # observed states of the batch, in normalised coordinates, which keeps the learned dynamics cheap to integrate;
+    # reg_weight=None takes the default weight of the regulariser, see regularisation.py
+
+    # an ensembleODE trains its K members in one pass, each on its own batch_size windows
+    n_members = getattr(model, 'n_members', 1)
+    nf = true_y.size(dim=true_y.ndim-1)
+
+    # Random window batches, e.g. windowSampler(t, true_y, replace=False, seed=0) for seeded epoch-wise sampling
+    if sampler is None:
+        sampler = windowSampler(t, true_y, batch_time, batch_size * n_members)
+
+    # with solver_stats=True the solver work and the tensors saved for backpropagation during the forward pass
+    # (not the peak memory, see forwardSavedMemory) of every iteration are recorded, and returned after lr_list;
+    # stiffness=True adds the Jacobian stiffness ratio along the predicted windows (costly)
+    # gradient: 'direct', 'adjoint' or 'checkpoint', see ode_solver(); solver='rosenbrock23' with gradient='adjoint'
+    # solves the adjoints with rosenbrock23 as well, with state-sized Jacobians only
+    ode_func = instrumentedODE(model) if solver_stats else model
+    memory = [None]
+
+    def forward(batch):
+        batch_y0, batch_t, batch_y = batch
+        # torchDiffEq provided solvers, or the native implicit solver 'rosenbrock23',
+        # e.g. solver='scipy_solver' with options={"solver": "BDF"}; rtol, atol (default: None) see ode_solver()
+        if solver_stats:
+            ode_func.reset()
+        with forwardSavedMemory() as memory[0]:
+            pred_y = ode_solver(ode_func, batch_y0, batch_t, method=solver, rtol=rtol, atol=atol, gradient=gradient,
+                                adjoint_method=adjoint_method, adjoint_options=adjoint_options, n_segments=n_segments)
+        # the member blocks of an ensemble, (n_members, batch_time * batch_size, nf)
+        def by_member(y):
+            return y.reshape(batch_t.size(dim=0), n_members, -1, nf).transpose(0, 1).reshape(n_members, -1, nf)
+        if regulariser is None:
+            return by_member(pred_y), by_member(batch_y)
+        return by_member(pred_y), by_member(batch_y), regularisation_penalty(regulariser, model, batch_t[0], by_member(batch_y), n_members, reg_weight)
+
+    def after_backward(batch, pred_y):
+        stats = ode_func.statistics()
+        stats['forward_saved_bytes'] = memory[0].nbytes
+        if stiffness:
+            # member blocks of an ensemble along the first dimension
+            batch_t = batch[1]
+            ratio, max_eigenvalue = stiffness_ratio(model, batch_t, pred_y.reshape(n_members, batch_t.size(dim=0), -1, nf).transpose(1, 2).reshape(-1, batch_t.size(dim=0), 1, nf))
+            stats['stiffness_ratio'], stats['max_eigenvalue'] = ratio.max().item(), max_eigenvalue.max().item()
+        return stats
+
+    model, loss_list, grad_norm, lr_list, telemetry = training_engine(model, sampler, forward, n_iters, 'NODE', ilr=ilr, loss=loss, loss_options=loss_options,
+        scheduler=scheduler, scheduler_options=scheduler_options, patience=patience, min_delta=min_delta, tol=tol,
+        validation_fn=validation_fn, target_rmse=target_rmse, validate_every=validate_every,
+        after_backward=after_backward if solver_stats else None, log_path=log_path)
+
+    if solver_stats:
+        return model, loss_list, grad_norm, lr_list, telemetry.stats
     return model, loss_list, grad_norm, lr_list
-
-# Random Batch function
-def get_batch(batch_time, batch_size, true_y, t):
-    data_size = t.size(dim=t.ndim-1)
-    s = torch.from_numpy(np.random.choice(np.arange(data_size - batch_time, dtype=np.int64), batch_size, replace=True))
-    batch_y0 = true_y[s]
-    batch_t = t[:batch_time]
-    batch_y = torch.stack([true_y[s + i] for i in range(batch_time)], dim=0)
-    return batch_y0, batch_t, batch_y
\ No newline at end of file
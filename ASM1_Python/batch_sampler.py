@@ -0,0 +1,80 @@
+import torch
+
+### Random window batches for NODE training ###
+
+class windowSampler:
+
+    def __init__(self, t, true_y, batch_time=16, batch_size=512, replace=True, seed=None):
+        """
+        Serves random windows of consecutive time points of one or several trajectories.
+
+        The windows are strided views over `true_y` (no copies), so a batch is one index
+        gather. With replace=False the windows are drawn epoch-wise without replacement.
+
+        Args:
+            t: A torch list of equally spaced time points.
+            true_y: A torch tensor with dimension (length(t), 1, number_of_features),
+                or (length(t), number_of_trajectories, number_of_features).
+            batch_time: Default number of time points per window.
+            batch_size: Default number of windows per batch.
+            replace: Draw with replacement (default: True), or epoch-wise without.
+            seed: Seed of the sampler's own random generator (default: None, the global torch
+                random generator, so torch.manual_seed() makes the batches reproducible).
+        """
+        self.t = t
+        self.nf = true_y.size(dim=true_y.ndim-1)
+        self.y = true_y.reshape(true_y.size(dim=0), -1, self.nf)
+        self.n_traj = self.y.size(dim=1)
+        self.batch_time = batch_time
+        self.batch_size = batch_size
+        self.replace = replace
+
+        self.generator = None if seed is None else torch.Generator().manual_seed(seed)
+
+        self.windows = {}
+        self.order = None
+        self.position = 0
+
+    def window_view(self, batch_time):
+        # (number_of_starts, number_of_trajectories, number_of_features, batch_time), a view of self.y
+        if batch_time not in self.windows:
+            self.windows[batch_time] = self.y.unfold(0, batch_time, 1)
+        return self.windows[batch_time]
+
+    def draw(self, n_windows, batch_size):
+        if self.replace:
+            return torch.randint(n_windows, (batch_size,), generator=self.generator)
+
+        # epoch-wise sampling without replacement, reshuffled when the windows run out
+        if self.order is None or self.order.numel() != n_windows:
+            self.order = torch.randperm(n_windows, generator=self.generator)
+            self.position = 0
+        index = []
+        while batch_size > 0:
+            if self.position == n_windows:
+                self.order = torch.randperm(n_windows, generator=self.generator)
+                self.position = 0
+            take = min(batch_size, n_windows - self.position)
+            index.append(self.order[self.position:self.position + take])
+            self.position += take
+            batch_size -= take
+        return torch.cat(index)
+
+    def __call__(self, batch_time=None, batch_size=None):
+        """
+        Returns:
+            batch_y0: Initial states with dimension (batch_size, 1, number_of_features).
+            batch_t: The first batch_time time points.
+            batch_y: Windows with dimension (batch_time, batch_size, 1, number_of_features).
+        """
+        batch_time = self.batch_time if batch_time is None else batch_time
+        batch_size = self.batch_size if batch_size is None else batch_size
+
+        windows = self.window_view(batch_time)
+        s = self.draw(windows.size(dim=0) * self.n_traj, batch_size)
+        start, traj = s // self.n_traj, s % self.n_traj
+
+        batch_y0 = self.y[start, traj].unsqueeze(1)
+        batch_t = self.t[:batch_time]
+        batch_y = windows[start, traj].permute(2, 0, 1).unsqueeze(2)
+        return batch_y0, batch_t, batch_y
@@ -1,98 +1,159 @@
 import numpy as np
 import torch
+from data_cache import cached_result
+from kernels import calculate_kernel, kernel_radius
+from bandwidth_selection import select_bandwidth
 
-def collocate_data_torch(t, true_y, kernel_str="EpanechnikovKernel"):
+def collocate_data_torch(t, true_y, kernel_str="EpanechnikovKernel", chunk_size=None, cache=False, kernel_tol=None,
+    bandwidth=None, per_state=False):
     """
     Computes a non-parametrically smoothed estimate of `y` and `y'` given the
     `data`.
 
     Args:
-        t: A torch list of time points.
-        true_y: A torch matrix with dimension (length(tpoints), 1, number_of_features).   
-        kernel_str: The kernel function to use (default: "EpanechnikovKernel").
+        t: A torch list of time points (in ascending order).
+        true_y: A torch matrix with dimension (length(tpoints), 1, number_of_features),
+            or (length(tpoints), number_of_scenarios, number_of_features).
+        kernel_str: The kernel function to use (default: "EpanechnikovKernel"), see kernels.py.
+        chunk_size: Number of time points fitted together (default: None, chosen to bound memory).
+        cache: Reuse the result of the same data, kernel and bandwidth from the on-disk cache (default: False).
+        kernel_tol: Truncates a kernel without compact support, e.g. "GaussianKernel", where it falls
+            below kernel_tol times its peak, so that only the points nearby are visited (default: None).
+        bandwidth: The bandwidth in the units of t, or 'gcv' / 'loo' to select it by cross-validation,
+            see select_bandwidth() (default: None, the rule n**(-1/5) * n**(-3/35) * log(n)**(-1/16)).
+        per_state: With 'gcv' or 'loo', selects one bandwidth per feature (and scenario) (default: False).
 
     Returns:
         y: The smoothed data.
         dy: The smoothed derivative of the data.
     """
-    data = torch.squeeze(true_y).detach().numpy()
     tpoints = t.detach().numpy()
 
     nt = len(tpoints)
-    nd = data.shape[0]
+    nd = true_y.size(dim=0)
 
     if nt > nd:
         n = nd
         tpoints = tpoints[:n]
     elif nt < nd:
         n = nt
-        data = data[:n,:]
     else:
         n = nt       
 
-    y = np.zeros_like(data)
-    dy = np.zeros_like(data)
+    # all features (and scenarios) are smoothed together as columns of one matrix
+    data = true_y[:n].detach().reshape(n, -1).numpy()
 
-    h = n**(-1 / 5) * n**(-3 / 35) * (np.log(n))**(-1 / 16)
+    if bandwidth is None:
+        h = n**(-1 / 5) * n**(-3 / 35) * (np.log(n))**(-1 / 16)
+    else:
+        h = bandwidth
+
+    def collocate():
+        # a selected bandwidth is part of the cached result, so a cache hit skips the cross-validation
+        hs = h
+        if isinstance(hs, str):
+            hs, _ = select_bandwidth(tpoints, data, criterion=hs, per_state=per_state, kernel_str=kernel_str, kernel_tol=kernel_tol)
+        if np.ndim(hs) == 0:
+            y, dy = local_polynomial_fit(tpoints, data, hs, kernel_str, chunk_size, kernel_tol)
+        else:
+            # one fit per selected bandwidth, over the columns that share it
+            y, dy = np.zeros_like(data), np.zeros_like(data)
+            for hc in np.unique(hs):
+                columns = hs == hc
+                y[:, columns], dy[:, columns] = local_polynomial_fit(tpoints, data[:, columns], hc, kernel_str, chunk_size, kernel_tol)
+        return torch.from_numpy(y).view(n, *true_y.shape[1:]), torch.from_numpy(dy).view(n, *true_y.shape[1:])
+
+    if cache:
+        # keyed on the bandwidth, or on how it is selected
+        bandwidth_key = (h, per_state) if isinstance(h, str) else torch.as_tensor(h)
+        return cached_result(collocate, 'collocate_data_torch', torch.from_numpy(tpoints), torch.from_numpy(data), kernel_str,
+                             bandwidth_key, kernel_tol)
+    return collocate()
+
+
+def local_polynomial_fit(tpoints, data, h, kernel_str="EpanechnikovKernel", chunk_size=None, kernel_tol=None, points=None):
+    """
+    Local linear estimate of `y` and local quadratic estimate of `y'` at every time point.
 
-    e1 = np.array([1, 0])
-    e2 = np.array([0, 1, 0])
+    Rather than building the n x n weight matrix, the 2x2 and 3x3 weighted normal equations
+    of each point are assembled from the moment sums of the kernel weights. For kernels with
+    compact support, only the points inside the bandwidth are visited, so the cost is O(n*w)
+    with w the number of points in one window; kernel_tol truncates the others to a compact support.
 
-    for i in range(n):
-        t1 = np.hstack((np.ones((n, 1)), np.reshape(tpoints - tpoints[i], (n, 1))))
-        t2 = np.hstack((t1, np.reshape((tpoints - tpoints[i])**2, (n, 1))))
-        
-        w1 = np.zeros(n)
-        for j in range(n):
-            w1[j] = calculate_kernel(kernel_str,(tpoints[j]-tpoints[i])/h)/h
-        
-        w = np.diag(w1)
+    Args:
+        tpoints: A numpy array of ascending time points with length n.
+        data: A numpy matrix with dimension (n, number_of_columns).
+        h: The bandwidth.
+        kernel_str: The kernel function to use (default: "EpanechnikovKernel").
+        chunk_size: Number of time points fitted together (default: None, chosen to bound memory).
+        kernel_tol: Truncation tolerance of the kernel, see kernel_radius() (default: None).
+        points: Indices of the time points to fit (default: None, all); the fits still use all data.
 
-        # if not 'singular matrix'
-        try:
-            y[i, :] = e1 @ np.linalg.solve(t1.T @ w @ t1, t1.T) @ w @ data
-            dy[i, :] = e2 @ np.linalg.solve(t2.T @ w @ t2, t2.T) @ w @ data
-        # if is 'singular matrix', use pseudoinverse
-        except np.linalg.LinAlgError:
-            y[i, :] = e1 @ (np.linalg.pinv(t1.T @ w @ t1) @ t1.T) @ w @ data
-            dy[i, :] = e2 @ (np.linalg.pinv(t2.T @ w @ t2) @ t2.T) @ w @ data      
+    Returns:
+        y: The smoothed data, with the same dimension and dtype as `data`, or (len(points), number_of_columns).
+        dy: The smoothed derivative of the data.
+    """
+    n, nc = data.shape
+    tpoints = tpoints.astype(np.float64)
+    points = np.arange(n) if points is None else np.asarray(points)
+    m = len(points)
+
+    # index window [lo, hi) of the points each fit has to visit
+    radius = kernel_radius(kernel_str, kernel_tol)
+    if radius is None:
+        lo = np.zeros(m, dtype=np.int64)
+        hi = np.full(m, n, dtype=np.int64)
+    else:
+        # widened by one point on each side, the kernel itself decides on the boundary
+        lo = np.maximum(np.searchsorted(tpoints, tpoints[points] - radius * h, side='left') - 1, 0)
+        hi = np.minimum(np.searchsorted(tpoints, tpoints[points] + radius * h, side='right') + 1, n)
+    width = int(np.max(hi - lo, initial=1))
+
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // (width * (nc + 8)))
+
+    y = np.zeros((m, nc), dtype=data.dtype)
+    dy = np.zeros((m, nc), dtype=data.dtype)
+
+    for start in range(0, m, chunk_size):
+        out = slice(start, min(start + chunk_size, m))
+        rows = points[out]
+        idx = lo[out, None] + np.arange(width)
+        inside = idx < hi[out, None]
+        idx = np.minimum(idx, n - 1)
 
-        # or use least square optimisation
-        # y[i, :] = e1 @ (np.linalg.lstsq(t1.T @ w @ t1, t1.T, rcond=None)[0]) @ w @ data
-        # dy[i, :] = e2 @ (np.linalg.lstsq(t2.T @ w @ t2, t2.T, rcond=None)[0]) @ w @ data
+        # scaled distances u = (t_j - t_i)/h and kernel weights, zero for padding
+        u = (tpoints[idx] - tpoints[rows, None]) / h
+        w = np.where(inside, calculate_kernel(kernel_str, u, kernel_tol) / h, 0.0)
 
-    return torch.unsqueeze(torch.from_numpy(y),dim=1), torch.unsqueeze(torch.from_numpy(dy),dim=1)
+        # moment sums S_k = sum w u^k and T_k = sum w u^k y
+        wu = w[:, :, None] * u[:, :, None] ** np.arange(5)
+        S = np.sum(wu, axis=1)
+        T = np.matmul(wu[:, :, :3].transpose(0, 2, 1), data[idx])
 
+        # polynomial basis in u, so the slope in t is beta_1/h
+        beta1 = solve_normal_equations(S[:, [[0, 1], [1, 2]]], T[:, :2])
+        beta2 = solve_normal_equations(S[:, [[0, 1, 2], [1, 2, 3], [2, 3, 4]]], T)
+        y[out] = beta1[:, 0]
+        dy[out] = beta2[:, 1] / h
 
-def calculate_kernel(kernel_str, t):
+    return y, dy
+
+
+def solve_normal_equations(A, B):
     """
-    Calculates the value of the specified kernel function.
+    Solves a stack of normal equations A x = B.
 
     Args:
-        kernel_str: The name of the kernel function.
-        t: The input value of timepoints[i].
+        A: A numpy array with dimension (m, p, p).
+        B: A numpy array with dimension (m, p, number_of_columns).
 
     Returns:
-        The value of the kernel function.
+        The solutions with dimension (m, p, number_of_columns).
     """
-
-    kernel_functions = {
-        "EpanechnikovKernel": lambda t: 0.75 * (1 - t**2) if abs(t) <= 1 else 0,
-        "UniformKernel": lambda t: 0.5 if abs(t) <= 1 else 0,
-        "TriangularKernel": lambda t: 1 - abs(t) if abs(t) <= 1 else 0,
-        "QuarticKernel": lambda t: (15 * (1 - t**2)**2) / 16 if abs(t) <= 0 else 0,
-        "TriweightKernel": lambda t: (35 * (1 - t**2)**3) / 32 if abs(t) <= 0 else 0,
-        "TricubeKernel": lambda t: (70 * (1 - abs(t)**3)**3) / 80 if abs(t) <= 0 else 0,
-        "CosineKernel": lambda t: (np.pi * np.cos(np.pi * t / 2)) / 4 if abs(t) <= 0 else 0,
-        "GaussianKernel": lambda t: np.exp(-0.5 * t**2) / np.sqrt(2 * np.pi),
-        "LogisticKernel": lambda t: 1 / (np.exp(t) + 2 + np.exp(-t)),
-        "SigmoidKernel": lambda t: 2 / (np.pi * (np.exp(t) + np.exp(-t))),
-        "SilvermanKernel": lambda t: (
-            0.5 * np.sin(abs(t) / 2 + np.pi / 4) * np.exp(-abs(t) / np.sqrt(2))
-        ),
-    }
-
-    if kernel_str not in kernel_functions:
-        raise ValueError("Wrong kernel function name!")
-
-    return kernel_functions[kernel_str](t)
\ No newline at end of file
+    # if not 'singular matrix'
+    try:
+        return np.linalg.solve(A, B)
+    # if is 'singular matrix', use pseudoinverse
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(A) @ B
@@ -1,96 +1,146 @@
+import copy
+import time
 import torch
 import numpy as np
+from training_engine import training_engine, loss_functions
+from training_telemetry import trainingTelemetry, gradient_norm
+from regularisation import regularisation_penalty
 
-def collocation_training(t, y, dy, model, n_iters=2000, batch_time=16, batch_size=512):
+def collocation_training(t, y, dy, model, n_iters=2000, batch_time=16, batch_size=512, patience=None, min_delta=1e-2, tol=0.0, log_path=None,
+    loss='mae', loss_options=None, scheduler='step', scheduler_options=None, validation_fn=None, target_rmse=None, validate_every=100,
+    ilr=1e-1, regulariser=None, reg_weight=None):
 
-    # Training initialization
-    ilr = 1e-1  # learning rate
+    # the loss (default: MAE), the learning rate schedule (default: halving from ilr at fixed fractions of n_iters)
+    # and early stopping on a loss plateau (patience) or on the validation RMSE (validation_fn, target_rmse),
+    # see training_engine()
 
-    gamma = 0.5
-    lr_adjust = {int(0.2 * n_iters): gamma * ilr, int(0.4 * n_iters): gamma ** 2 * ilr, int(0.5 * n_iters): gamma ** 3 * ilr, int(0.6 * n_iters): gamma ** 4 * ilr,
-                int(0.7 * n_iters): gamma ** 5 * ilr, int(0.8 * n_iters): gamma ** 6 * ilr, int(0.9 * n_iters): gamma ** 7 * ilr}
-    # lr_adjust = {int(0.2 * n_iters): gamma * ilr, int(0.8 * n_iters): gamma ** 2 * ilr}
-    # print(lr_adjust)
-    optimizer = torch.optim.Adam(model.parameters(), lr=ilr)
+    # regulariser: 'jacobian', 'kinetic' or 'taylor' adds reg_weight times the penalty of the vector field at the
+    # states of the batch, in normalised coordinates, which keeps the learned dynamics cheap to integrate;
+    # reg_weight=None takes the default weight of the regulariser, see regularisation.py
 
-    loss_list = []  # record loss data
-    grad_norm = [] # record gardient norm data
-    lr_list = []  # record learning rate data
-    show_all_loss = False
-
-    # Define the loss function: Mean Squared Error
-    # The sum of the squares of the differences between prediction and ground truth
-    loss_mse = torch.nn.MSELoss(reduction='mean')
-
-    # Define a Huber Loss Parameter: Delta
-    delta_loss = 0.03
-
-    # Train iteration
-    print("Starting collocation training.")
-
-    for it in range(1, n_iters + 1):
-        model.train(mode=True)
-        optimizer.zero_grad()
-        batch_y, batch_dy = collocation_batch(batch_size, y, dy)
-        # print('batch_y0, batch_t batch_y size:===', batch_y0.size(),batch_t.size(),batch_y.size())
+    # an ensembleODE trains its K members in one pass, each on its own batch_size points
+    n_members = getattr(model, 'n_members', 1)
+    nf = y.size(dim=y.ndim-1)
 
+    def forward(batch):
+        batch_y, batch_dy = batch
         pred_dy = model(t, batch_y)
+        if regulariser is None:
+            return pred_dy.reshape(n_members, -1, nf), batch_dy.reshape(n_members, -1, nf)
+        return pred_dy.reshape(n_members, -1, nf), batch_dy.reshape(n_members, -1, nf), regularisation_penalty(regulariser, model, t, batch_y, n_members, reg_weight)
+
+    model, loss_list, grad_norm, lr_list, _ = training_engine(model, lambda: collocation_batch(batch_size * n_members, y, dy), forward, n_iters,
+        'collocation', ilr=ilr, loss=loss, loss_options=loss_options, scheduler=scheduler, scheduler_options=scheduler_options,
+        patience=patience, min_delta=min_delta, tol=tol, validation_fn=validation_fn, target_rmse=target_rmse,
+        validate_every=validate_every, log_path=log_path)
+    return model, loss_list, grad_norm, lr_list
 
-        # define a weighted loss function，also called MAPE (mean absolute percentage error)
-        # mask = batch_dy != 0
-        # loss = torch.mean(torch.abs((pred_dy[mask] - batch_dy[mask])/batch_dy[mask]))
-
-        # define RMSE as the loss function (L2)
-        # loss = torch.sqrt(loss_mse(pred_dy, batch_dy))
-
-        # define MAE as the loss function (L1)
-        loss = torch.mean(torch.abs(pred_dy - batch_dy))
-        # loss_L1 = nn.L1Loss(reduction='mean')
-        # loss = loss_L1(pred_dy, batch_dy)
-            
-        # define MSE as the loss function
-        # loss = loss_mse(pred_dy, batch_dy)
-
-        # define a Huber loss function
-        # loss = torch.mean(torch.where(torch.abs(pred_dy - batch_dy) < delta_loss, 0.5 * ((pred_dy - batch_dy) ** 2), delta_loss * torch.abs(pred_dy - batch_dy) - 0.5 * (delta_loss ** 2)))
-
-        # define a log cosh loss function
-        # loss = torch.mean(torch.log(torch.cosh(pred_dy - batch_dy)))
 
+def full_batch_collocation_training(t, y, dy, model, n_iters=50, max_iter=20, history_size=50, loss='mse', loss_options=None,
+    target_loss=None, refine_iters=0, refine_lr=1e-3, log_path=None):
+    """
+    Collocation training on all collocated points at once with L-BFGS and a strong Wolfe line search,
+    optionally followed by Adam refinement on minibatches. The collocated data of one or a few
+    trajectories fit in one batch, and matching the derivatives is a smooth regression problem.
+
+    Args:
+        t, y, dy: As collocation_training().
+        model: The model to train, e.g. a neuralODE, an ensembleODE or a hybridODE.
+        n_iters: Maximum number of L-BFGS steps, each of at most max_iter iterations.
+        max_iter, history_size: The options of torch.optim.LBFGS.
+        loss: The loss minimised by L-BFGS, see training_engine() (default: 'mse', as L-BFGS needs a smooth loss).
+        loss_options: The options of the loss.
+        target_loss: Stops once the full-batch MAE, the loss of collocation_training(), is at most target_loss.
+        refine_iters: Number of Adam iterations on minibatches afterwards (default: 0, none).
+        refine_lr: The initial learning rate of the refinement, decaying along a cosine.
+        log_path: Writes the telemetry of the L-BFGS steps to this file, see trainingTelemetry (default: None).
+
+    Returns:
+        model, loss_list, grad_norm, lr_list as collocation_training(), the loss being the full-batch MAE
+            during the L-BFGS steps, followed by those of the refinement.
+        elapsed: The wall time at the end of every L-BFGS step, in seconds from the start.
+    """
+    n_members = getattr(model, 'n_members', 1)
+    nf = y.size(dim=y.ndim-1)
+    loss_fn = loss_functions[loss] if isinstance(loss, str) else loss
+    loss_options = loss_options or {}
+
+    # every member of an ensemble on all points
+    all_y = y.reshape(-1, 1, nf).repeat(n_members, 1, 1)
+    all_dy = dy.reshape(1, -1, nf).expand(n_members, -1, nf)
+
+    params = [p for p in model.parameters() if p.requires_grad]
+    optimizer = torch.optim.LBFGS(params, lr=1, max_iter=max_iter, history_size=history_size, line_search_fn='strong_wolfe')
+    telemetry = trainingTelemetry(n_iters, n_members, log_path)
+
+    def closure():
+        optimizer.zero_grad()
+        loss_members = loss_fn(model(t, all_y).reshape(n_members, -1, nf), all_dy, **loss_options)
+        loss = torch.sum(loss_members)
         loss.backward()
+        return loss
 
-        loss_list.append(loss.item())
-        lr_list.append(optimizer.param_groups[-1]['lr'])
-
-        # ========================== gradient norm ==================
-        total_norm = 0.0
-        for p in model.parameters():
-            param_norm = p.grad.detach().data.norm(2)
-            total_norm += param_norm.item() ** 2
-        total_norm = total_norm ** 0.5
-        # print(total_norm)
-        grad_norm.append(total_norm)
-
-        # ==========================gradient norm end ==============
-
-        optimizer.step()
-        # scheduler.step()
-
-        # ====================adjust lr========================
-
-        if it in lr_adjust.keys():
-            lr = lr_adjust[it]
-            for param_group in optimizer.param_groups:
-                param_group['lr'] = lr
-        #     # print('Updating learning rate to {}'.format(lr))
-
-        if show_all_loss:
-            print('Iter {:04d} | Loss {:.7f}'.format(it, loss.item()))
-            # plot_loss(loss_list)
-        else:
-            if it % 250 == 0:
-                print('Iteration: ', it, '/', n_iters)
-    return model, loss_list, grad_norm, lr_list
+    print("Starting full-batch collocation training.")
+    model.train(mode=True)
+    start = time.perf_counter()
+    elapsed = []
+    for it in range(1, n_iters + 1):
+        with telemetry.phase('optimizer'):
+            optimizer.step(closure)
+        with telemetry.phase('forward'):
+            with torch.no_grad():
+                mae = torch.mean(torch.abs(model(t, all_y).reshape(n_members, -1, nf) - all_dy), dim=(1, 2))
+        telemetry.record(mae, gradient_norm(model, n_members), optimizer.param_groups[0]['lr'])
+        elapsed.append(time.perf_counter() - start)
+
+        if target_loss is not None and torch.all(mae <= target_loss):
+            print('Reached the target loss at L-BFGS step: ', it, '/', n_iters, ', {:.1f} s'.format(elapsed[-1]))
+            break
+
+    loss_list, grad_norm, lr_list = telemetry.close()
+    print('Full-batch collocation training: {} L-BFGS steps, {:.1f} s'.format(len(loss_list), elapsed[-1]))
+
+    if refine_iters > 0:
+        model, refine_loss, refine_grad, refine_lr_list = collocation_training(t, y, dy, model, n_iters=refine_iters, ilr=refine_lr,
+            scheduler='cosine', scheduler_options={'min_lr': refine_lr / 100})
+        loss_list, grad_norm, lr_list = loss_list + refine_loss, grad_norm + refine_grad, lr_list + refine_lr_list
+
+    return model, loss_list, grad_norm, lr_list, elapsed
+
+
+def collocation_time_to_target(t, y, dy, model, target_loss, n_iters=2000, lbfgs_iters=50, validate_every=10):
+    """
+    Trains copies of model by minibatch Adam (collocation_training()) and by full-batch L-BFGS
+    (full_batch_collocation_training()) until the full-batch MAE reaches target_loss, and reports the wall times.
+
+    Returns:
+        A dict per mode with the wall time in seconds, the final full-batch MAE and whether the target was reached.
+    """
+    n_members = getattr(model, 'n_members', 1)
+    nf = y.size(dim=y.ndim-1)
+    all_y = y.reshape(-1, 1, nf).repeat(n_members, 1, 1)
+
+    def full_batch_mae(m):
+        with torch.no_grad():
+            return torch.mean(torch.abs(m(t, all_y).reshape(n_members, -1, nf) - dy.reshape(1, -1, nf)), dim=(1, 2))
+
+    results = {}
+    start = time.perf_counter()
+    minibatch_model, *_ = collocation_training(t, y, dy, copy.deepcopy(model), n_iters=n_iters,
+                                               validation_fn=full_batch_mae, target_rmse=target_loss, validate_every=validate_every)
+    results['minibatch'] = {'time': time.perf_counter() - start}
+    final = full_batch_mae(minibatch_model)
+    results['minibatch'].update({'loss': final.tolist(), 'reached': bool(torch.all(final <= target_loss))})
+
+    start = time.perf_counter()
+    full_batch_model, *_ = full_batch_collocation_training(t, y, dy, copy.deepcopy(model), n_iters=lbfgs_iters, target_loss=target_loss)
+    results['full_batch'] = {'time': time.perf_counter() - start}
+    final = full_batch_mae(full_batch_model)
+    results['full_batch'].update({'loss': final.tolist(), 'reached': bool(torch.all(final <= target_loss))})
+
+    for mode, result in results.items():
+        print('{}: {:.1f} s, loss {}, target {}'.format(mode, result['time'], result['loss'], 'reached' if result['reached'] else 'not reached'))
+    return results
 
 # Random Batch function
 def collocation_batch(batch_size, y, dy, shuffle=True):
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import torch
+
+### Content-addressed on-disk cache of generated data ###
+
+default_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cache')
+
+def hash_inputs(*inputs):
+    """
+    Hashes the inputs of a computation (tensors, numbers, strings) into a hex key.
+    Tensors are hashed by dtype, shape and content.
+    """
+    h = hashlib.sha256()
+    for x in inputs:
+        if isinstance(x, torch.Tensor):
+            h.update(('tensor:%s:%s:' % (x.dtype, tuple(x.shape))).encode())
+            h.update(x.detach().cpu().contiguous().numpy().tobytes())
+        else:
+            h.update(('%s:%r:' % (type(x).__name__, x)).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def cached_result(compute, *inputs, cache_dir=default_cache_dir, max_bytes=2**30):
+    """
+    Returns the result of compute() from the cache if the same inputs were seen before,
+    otherwise computes it and stores it.
+
+    Entries are binary torch files named by the hash of the inputs, so any change of the
+    inputs gives a new entry. The cache is bounded to max_bytes by evicting the least
+    recently used entries.
+
+    Args:
+        compute: A function without arguments returning a tensor or a tuple of tensors.
+        inputs: Everything the result depends on.
+        cache_dir: The cache directory.
+        max_bytes: The maximum total size of the cache.
+
+    Returns:
+        The (cached) result of compute().
+    """
+    path = os.path.join(cache_dir, hash_inputs(*inputs) + '.pt')
+
+    if os.path.exists(path):
+        try:
+            result = torch.load(path)
+            os.utime(path)  # mark as recently used
+            print("Loaded from cache.")
+            return result
+        except Exception:
+            # unreadable entry, e.g. an interrupted write: recompute it
+            os.remove(path)
+
+    result = compute()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    torch.save(result, tmp_path)
+    os.replace(tmp_path, path)
+    evict_cache(cache_dir, max_bytes)
+
+    return result
+
+
+def evict_cache(cache_dir=default_cache_dir, max_bytes=2**30):
+    # remove least recently used entries until the cache fits in max_bytes
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.pt')]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    total = 0
+    for path in entries:
+        total += os.path.getsize(path)
+        if total > max_bytes:
+            os.remove(path)
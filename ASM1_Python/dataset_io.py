@@ -0,0 +1,59 @@
+import json
+import os
+import numpy as np
+import torch
+
+### Binary dataset storage: one .npy file per array plus a metadata.json, read back memory-mapped ###
+
+state_names = ['S_I', 'S_S', 'X_I', 'X_S', 'X_BH', 'X_BA', 'X_P', 'S_O', 'S_NO', 'S_NH', 'S_ND', 'X_ND', 'S_ALK', 'S_N2', 'X_INORG']
+state_units = ['mg COD/l', 'mg COD/l', 'mg COD/l', 'mg COD/l', 'mg COD/l', 'mg COD/l', 'mg COD/l', 'mg O2/l', 'mg N/l', 'mg N/l', 'mg N/l', 'mg N/l', 'eq ALK/l', 'mg N/l', 'mg COD/l']
+
+def save_dataset(path, metadata=None, **arrays):
+    """
+    Saves a dataset in binary form, e.g. save_dataset(path, t=t, true_y=true_y, true_dy=true_dy).
+
+    Args:
+        path: The dataset directory.
+        metadata: A dict of JSON serialisable information, tensors are stored as lists
+            (default: None, only the state names and units).
+        arrays: The torch tensors or numpy arrays to store, such as t, true_y, true_dy, coll_y, coll_dy.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    info = {'state_names': state_names, 'state_units': state_units, 'time_unit': 'day'}
+    for key, value in (metadata or {}).items():
+        info[key] = value.tolist() if isinstance(value, (torch.Tensor, np.ndarray)) else value
+
+    info['arrays'] = {}
+    for name, value in arrays.items():
+        value = value.detach().cpu().numpy() if isinstance(value, torch.Tensor) else np.asarray(value)
+        np.save(os.path.join(path, name + '.npy'), value)
+        info['arrays'][name] = {'shape': list(value.shape), 'dtype': str(value.dtype)}
+
+    with open(os.path.join(path, 'metadata.json'), 'w') as f:
+        json.dump(info, f, indent=1)
+
+
+def load_dataset(path, names=None):
+    """
+    Loads a dataset saved by save_dataset() without reading it into memory.
+
+    The arrays are memory-mapped copy-on-write, so the returned tensors are zero-copy views
+    of the files; writing to them never changes the files.
+
+    Args:
+        path: The dataset directory.
+        names: The arrays to load (default: None, all of them).
+
+    Returns:
+        data: A dict of torch tensors.
+        metadata: The dict of metadata.
+    """
+    with open(os.path.join(path, 'metadata.json')) as f:
+        metadata = json.load(f)
+
+    data = {}
+    for name in (names or metadata['arrays'].keys()):
+        data[name] = torch.from_numpy(np.load(os.path.join(path, name + '.npy'), mmap_mode='c'))
+
+    return data, metadata
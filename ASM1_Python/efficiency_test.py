@@ -6,48 +6,48 @@ from model_initiation import model_initiation
 from collocate_data_torch import collocate_data_torch
 from collocation_training import collocation_training
 from NODE_training import NODE_training
+from batch_sampler import windowSampler
 from validation import validation
 from plot_loss_grad import plot_loss_grad
+import os
 import time
+import torch
+import torch.multiprocessing as mp
 from torch.nn import MSELoss
 from torch import sqrt
 import numpy as np
 
-# generate trajectory data from mathemetical modelling
-t, true_y, true_dy = IVP_data_generation()
-# plot_data(t, true_y)
-# plot_data(t, true_dy, active_only=True, y_labels=['True dy'], 
-#            unit_name = ['mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 
-#                         'mg COD/(l.d)', 'mg COD/(l.d)', '$mg O_2/(l.d)$', 'mg N/(l.d)', 'mg N/(l.d)', 
-#                         'mg N/(l.d)', 'mg N/(l.d)', 'eq ALK/(l.d)', 'mg N/(l.d)', 'mg COD/(l.d)'])
-
-# load data from previously saved files
-# t, true_y = load_data()
-# plot_data(t, true_y)
-# t, true_dy = load_data('ASM_CSTR/ASM1_NODE_package/data/true_dy.csv')
-# plot_data(t, true_dy, active_only=True, y_labels=['True dy'], 
-#            unit_name = ['mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 
-#                         'mg COD/(l.d)', 'mg COD/(l.d)', '$mg O_2/(l.d)$', 'mg N/(l.d)', 'mg N/(l.d)', 
-#                         'mg N/(l.d)', 'mg N/(l.d)', 'eq ALK/(l.d)', 'mg N/(l.d)', 'mg COD/(l.d)'])
-
-# estimation of mean and std
-noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale = estimate_mean_std(t, true_y)
-
-# collocation calculation
-coll_y, coll_dy = collocate_data_torch(t, true_y)
-# plot_data(t, coll_y, true_y, y_labels=['Coll y','True y'], active_only=True, show_RMSE=True)
-# plot_data(t, coll_dy, true_dy, y_labels=['Coll dy','True dy'], active_only=True, show_RMSE=True)
-
-mse = MSELoss()
-num_test = 1
-result_test = np.zeros((num_test,8))
-
-for i in range(num_test):
+result_header = ['No','I-Coll Time (s)','I-NODE Time (s)','Incremental Time (s)','NODE only Time (s)','I-Coll RMSE','I-NODE RMSE','NODE only RMSE','Seed']
+
+# dataset shared by the workers of the pool, set by init_worker()
+shared_data = {}
+
+def init_worker(data, n_threads):
+    # the tensors in data live in shared memory, workers only map them
+    shared_data.update(data)
+    torch.set_num_threads(n_threads)
+
+
+def run_test(i, seed):
+    """
+    Runs one test of the incremental strategy (collocation -> NODE training) and of NODE only training.
+
+    Returns:
+        A row of result_header.
+    """
+    t, true_y = shared_data['t'], shared_data['true_y']
+    coll_y, coll_dy = shared_data['coll_y'], shared_data['coll_dy']
+    noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale = shared_data['mean_std']
+
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    mse = MSELoss()
+    result_test = np.zeros(len(result_header))
 
     # ============incremental strategy =======================
     # model initiation
     model = model_initiation(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale)
-    
+
     # collocation training
     coll_start_time = time.time()
     model, loss_list, grad_norm, lr_list = collocation_training(t, coll_y, coll_dy, model)
@@ -57,38 +57,114 @@ for i in range(num_test):
     RMSE = sqrt(mse(pred_y, true_y)).numpy()
     # plot_data(t, pred_y, true_y, y_labels=['Pred','True'], show_RMSE=True)
     # plot_loss_grad(loss_list, grad_norm, lr_list)
-    result_test[i,0] = i
-    result_test[i,1] = coll_end_time-coll_start_time
-    result_test[i,5] = RMSE
+    result_test[0] = i
+    result_test[1] = coll_end_time-coll_start_time
+    result_test[5] = RMSE
 
     # NODE training
     node_start_time = time.time()
-    model, loss_list, grad_norm, lr_list = NODE_training(t, true_y, model)
+    model, loss_list, grad_norm, lr_list = NODE_training(t, true_y, model, sampler=windowSampler(t, true_y, seed=seed))
     node_end_time = time.time()
     # print('node training time = %.2f'%(node_end_time-node_start_time))
     pred_y = validation(model, t)
     RMSE = sqrt(mse(pred_y, true_y)).numpy()
     # plot_data(t, pred_y, true_y, y_labels=['Pred','True'], show_RMSE=True)
     # plot_loss_grad(loss_list, grad_norm, lr_list)
-    result_test[i,2] = node_end_time-node_start_time
-    result_test[i,6] = RMSE
-    result_test[i,3] = (coll_end_time-coll_start_time) + (node_end_time-node_start_time)
+    result_test[2] = node_end_time-node_start_time
+    result_test[6] = RMSE
+    result_test[3] = (coll_end_time-coll_start_time) + (node_end_time-node_start_time)
 
     # ====================node only =====================
     # model initiation
-    model = model_initiation(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale) 
+    model = model_initiation(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale)
 
     # NODE training
     node_start_time = time.time()
-    model, loss_list, grad_norm, lr_list = NODE_training(t, true_y, model)
+    model, loss_list, grad_norm, lr_list = NODE_training(t, true_y, model, sampler=windowSampler(t, true_y, seed=seed))
     node_end_time = time.time()
     # print('node training time = %.2f'%(node_end_time-node_start_time))
     pred_y = validation(model, t)
     RMSE = sqrt(mse(pred_y, true_y)).numpy()
     # plot_data(t, pred_y, true_y, y_labels=['Pred','True'], show_RMSE=True)
     # plot_loss_grad(loss_list, grad_norm, lr_list)
-    result_test[i,4] = node_end_time-node_start_time
-    result_test[i,7] = RMSE
+    result_test[4] = node_end_time-node_start_time
+    result_test[7] = RMSE
+    result_test[8] = seed
+
+    return result_test
+
+
+def efficiency_test(num_test=1, num_workers=None, base_seed=0,
+    result_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'efficiency_test_runs.csv')):
+    """
+    Runs num_test tests on a process pool, one test per worker at a time.
+
+    The generated dataset and its collocation are computed once and shared with the workers
+    through shared memory. Test i is seeded with base_seed + i, and every finished test is
+    appended to result_file straight away, so a crash loses only the running tests. Run again
+    with the same result_file, the tests already recorded there are skipped. The default file
+    keeps the published results in data/efficiency_test.csv, read by plot_efficiency.py, apart.
+
+    Returns:
+        result_test: A numpy matrix with one row of result_header per test, in order of No.
+    """
+    # resume: the rows of an earlier, possibly interrupted run of result_file are kept
+    result_test = np.zeros((num_test, len(result_header)))
+    done = set()
+    if os.path.exists(result_file) and os.path.getsize(result_file) > 0:
+        with open(result_file) as f:
+            if f.readline().strip() != ','.join(result_header):
+                raise ValueError("{} holds other results, choose another result_file!".format(result_file))
+        for row in np.loadtxt(result_file, delimiter=',', skiprows=1, ndmin=2):
+            if int(row[0]) < num_test:
+                result_test[int(row[0])] = row
+                done.add(int(row[0]))
+    todo = [i for i in range(num_test) if i not in done]
+    if len(todo) == 0:
+        return result_test
+
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    num_workers = min(num_workers, len(todo))
+    n_threads = max(1, os.cpu_count() // num_workers)
+
+    # generate trajectory data from mathemetical modelling
+    t, true_y, true_dy = IVP_data_generation(cache=True)
+
+    # estimation of mean and std
+    mean_std = estimate_mean_std(t, true_y)
+
+    # collocation calculation
+    coll_y, coll_dy = collocate_data_torch(t, true_y, cache=True)
+    # plot_data(t, coll_y, true_y, y_labels=['Coll y','True y'], active_only=True, show_RMSE=True)
+    # plot_data(t, coll_dy, true_dy, y_labels=['Coll dy','True dy'], active_only=True, show_RMSE=True)
+
+    data = {'t': t, 'true_y': true_y, 'coll_y': coll_y, 'coll_dy': coll_dy, 'mean_std': mean_std}
+    for value in [t, true_y, coll_y, coll_dy, *mean_std[1:]]:
+        value.share_memory_()
+
+    with open(result_file, 'a') as f:
+        if f.tell() == 0:
+            f.write(','.join(result_header) + '\n')
+            f.flush()
+
+        # called in the main process as soon as a test finishes, in any order
+        def record(row):
+            result_test[int(row[0])] = row
+            f.write(','.join('%.2f' % value for value in row) + '\n')
+            f.flush()
+
+        context = mp.get_context('spawn')
+        with context.Pool(num_workers, initializer=init_worker, initargs=(data, n_threads), maxtasksperchild=1) as pool:
+            tasks = [pool.apply_async(run_test, (i, base_seed + i), callback=record) for i in todo]
+            pool.close()
+            pool.join()
+            # re-raise the error of a failed test, after all others are recorded
+            for task in tasks:
+                task.get()
+
+    return result_test
+
 
-np.savetxt(fname='ASM_CSTR/ASM1_NODE_package-upload/data/efficiency_test.csv', X=result_test, fmt='%.2f', delimiter=',',
-           header=','.join(['No','I-Coll Time (s)','I-NODE Time (s)','Incremental Time (s)','NODE only Time (s)','I-Coll RMSE','I-NODE RMSE','NODE only RMSE' ]))
\ No newline at end of file
+if __name__ == '__main__':
+    efficiency_test(num_test=1)
@@ -0,0 +1,37 @@
+import copy
+import torch.nn as nn
+from torch.func import stack_module_state, functional_call, vmap
+
+### Define an ensemble of K NODE replicas evaluated in one vectorized pass ###
+
+class ensembleODE(nn.Module):
+
+    def __init__(self, models):
+        super(ensembleODE, self).__init__()
+        self.n_members = len(models)
+
+        # stacked weights, with the member as the first dimension of every tensor
+        params, _ = stack_module_state(models)
+        self.names = list(params.keys())
+        self.weights = nn.ParameterList([nn.Parameter(params[name]) for name in self.names])
+
+        # template of one member, kept in a list so that its own parameters are not registered
+        self.template = [copy.deepcopy(models[0])]
+
+    def forward(self, t, y):
+        # the batch holds K blocks of equal size, block k belongs to member k
+        y_members = y.reshape(self.n_members, -1, *y.shape[1:])
+        params = dict(zip(self.names, self.weights))
+
+        def member_forward(p, x):
+            return functional_call(self.template[0], p, (t, x))
+
+        return vmap(member_forward)(params, y_members).reshape(y.shape)
+
+    def member(self, k):
+        """
+        Returns member k as a stand-alone model, e.g. a neuralODE.
+        """
+        model = copy.deepcopy(self.template[0])
+        model.load_state_dict({name: w[k].detach().clone() for name, w in zip(self.names, self.weights)})
+        return model
@@ -4,18 +4,20 @@ import gc
 def estimate_mean_std(t, true_y):
     noFeature = true_y.size(dim=true_y.ndim-1)
 
-    diff_true_y = torch.diff(true_y, dim=0)
+    # several trajectories (length(t), S, noFeature) are pooled, differences are taken along each one
+    diff_true_y = torch.diff(true_y, dim=0).reshape(-1, noFeature)
+    true_y = true_y.reshape(-1, noFeature)
 
-    yMu = torch.mean(true_y, dim=0)
-    yStd = torch.std(true_y, dim=0)
+    yMu = torch.mean(true_y, dim=0, keepdim=True)
+    yStd = torch.std(true_y, dim=0, keepdim=True)
     yStd[yStd == 0.0] = 1e-12
-    dyMu = torch.mean(diff_true_y, dim=0)
-    dyStd = torch.std(diff_true_y, dim=0)
+    dyMu = torch.mean(diff_true_y, dim=0, keepdim=True)
+    dyStd = torch.std(diff_true_y, dim=0, keepdim=True)
 
-    yMax = torch.max(true_y, dim=0).values
-    yMin = torch.min(true_y, dim=0).values
-    dyMax = torch.max(diff_true_y, dim=0).values
-    dyMin = torch.min(diff_true_y, dim=0).values
+    yMax = torch.max(true_y, dim=0, keepdim=True).values
+    yMin = torch.min(true_y, dim=0, keepdim=True).values
+    dyMax = torch.max(diff_true_y, dim=0, keepdim=True).values
+    dyMin = torch.min(diff_true_y, dim=0, keepdim=True).values
 
     yScale = yMax - yMin
     yScale[yScale == 0.0] = yMax[yScale == 0.0]
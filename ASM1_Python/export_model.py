@@ -0,0 +1,69 @@
+import copy
+import torch
+import torch.nn as nn
+
+### NODE model with the normalisation folded into its weights, for inference ###
+
+class fusedODE(nn.Module):
+
+    def __init__(self, net, shift=None):
+        super(fusedODE, self).__init__()
+        self.net = net
+        self.centred = shift is not None
+        self.register_buffer('shift', shift if shift is not None else torch.zeros(1))
+
+    def forward(self, t, y):
+        if self.centred:
+            y = y - self.shift
+        return self.net(y)
+
+
+def export_model(model, compile='script'):
+    """
+    Folds the normalisation of a trained neuralODE into the first and last nn.Linear of its net,
+    and compiles the result for inference. Only the subtraction of in_shift is kept in front of the net:
+    folding it into the bias as well cancels large terms W / yStd * y in single precision.
+
+    Features that are constant in the data (ymax == ymin) are fed to the net as 0.0 by every
+    normalisation, their columns are dropped from the first layer rather than scaled by 1/yStd.
+
+    Args:
+        model: A neuralODE, for an ensembleODE export its members, model.member(k).
+        compile: 'script' for a frozen TorchScript graph (default), 'compile' for torch.compile,
+            or None for the plain fusedODE.
+
+    Returns:
+        The exported model, called as model(t, y) like the neuralODE, without gradients.
+    """
+    if hasattr(model, 'n_members'):
+        raise ValueError("Export the members of an ensemble one by one, model.member(k)!")
+    if not hasattr(model, 'net'):
+        raise ValueError("Only a neuralODE can be exported, e.g. the correction of a hybridODE, model.neural!")
+
+    net = copy.deepcopy(model.net)
+    first, last = net[0], net[-1]
+    with torch.no_grad():
+        # (y - in_shift) * in_scale, folded as W * in_scale
+        shift = None
+        if model.in_scale is not None:
+            in_scale = model.in_scale.reshape(-1)
+            in_scale = torch.where((model.ymax == model.ymin).reshape(-1), torch.zeros_like(in_scale), in_scale)
+            first.weight.mul_(in_scale)
+            shift = model.in_shift.detach().clone()
+        # y * out_scale + out_shift, folded as out_scale * W and out_scale * b + out_shift
+        if model.out_scale is not None:
+            out_scale = model.out_scale.double().reshape(-1)
+            last.weight.copy_(out_scale.reshape(-1, 1) * last.weight.double())
+            last.bias.copy_(out_scale * last.bias.double() + model.out_shift.double().reshape(-1))
+
+    fused = fusedODE(net, shift).eval()
+    for p in fused.parameters():
+        p.requires_grad_(False)
+
+    if compile == 'script':
+        return torch.jit.freeze(torch.jit.script(fused))
+    if compile == 'compile':
+        return torch.compile(fused)
+    if compile is not None:
+        raise ValueError("Wrong compile mode!")
+    return fused
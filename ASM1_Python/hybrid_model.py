@@ -0,0 +1,38 @@
+import torch
+import torch.nn as nn
+from torch.func import functional_call
+
+### Define a hybrid model: the ASM1 rates plus a neural correction ###
+
+class hybridODE(nn.Module):
+
+    def __init__(self, mechanistic, neural, freeze_mechanistic=False, freeze_neural=False):
+        super(hybridODE, self).__init__()
+        self.nf = mechanistic.nf
+        self.mechanistic = mechanistic
+        self.neural = neural
+
+        # the kinetic parameters are trained as log factors on their values, so that parameters
+        # of very different magnitude (u_H = 6, K_ALK = 0.001) move alike and stay positive;
+        # the stoichiometry is kept fixed to conserve COD, N and charge
+        self.mechanistic.kinetic.requires_grad_(False)
+        self.mechanistic.stoiP.requires_grad_(False)
+        self.log_kinetic = nn.Parameter(torch.zeros_like(mechanistic.kinetic), requires_grad=not freeze_mechanistic)
+
+        # the correction starts at zero, i.e. training starts from the mechanistic model,
+        # and is centred on zero rather than on the mean derivative
+        nn.init.zeros_(self.neural.net[-1].weight)
+        nn.init.zeros_(self.neural.net[-1].bias)
+        if self.neural.out_shift is not None:
+            self.neural.out_shift = torch.zeros_like(self.neural.out_shift)
+        self.neural.requires_grad_(not freeze_neural)
+
+    def forward(self, t, y):
+        dy = functional_call(self.mechanistic, {'kinetic': self.kinetic()}, (t, y)).view(y.shape)
+        return dy + self.neural(t, y)
+
+    def kinetic(self):
+        """
+        Returns the current kinetic parameters, in the order of default_stoichimetric_kinetic_value().
+        """
+        return self.mechanistic.kinetic * torch.exp(self.log_kinetic)
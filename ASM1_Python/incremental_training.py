@@ -0,0 +1,76 @@
+import time
+import numpy as np
+from collocate_data_torch import collocate_data_torch
+from collocation_training import collocation_training
+from NODE_training import NODE_training
+
+def incremental_training(t, true_y, model, coll_y=None, coll_dy=None, batch_time=4, growth=2, max_batch_time=64,
+    max_iters=2000, patience=100, min_delta=1e-2, tol=0.0, batch_size=512, solver='dopri5', ilr=1e-1, lr_decay=0.5, min_lr=1e-3):
+    """
+    Incremental strategy: collocation pre-training, then NODE training on a growing integration horizon.
+
+    Every stage runs with a constant learning rate until its loss has converged (see loss_plateaued()),
+    or for at most max_iters iterations. The horizon starts at batch_time time points, which keeps the
+    first NODE stages cheap and non-stiff, and is multiplied by growth at every plateau up to max_batch_time.
+    The learning rate is multiplied by lr_decay at every plateau as well, so a stage continues from the
+    previous one instead of restarting at ilr, and the last horizon is trained on until it falls below min_lr.
+
+    Args:
+        t: A torch list of equally spaced time points.
+        true_y: A torch tensor with dimension (length(t), 1, number_of_features).
+        model: The neuralODE to train.
+        coll_y, coll_dy: The collocated states and derivatives (default: None, computed by
+            collocate_data_torch()).
+        batch_time: Number of time points of the first NODE stage.
+        growth: Factor by which the horizon grows between stages.
+        max_batch_time: Number of time points of the last NODE stage (limited to length(t)).
+        max_iters: Maximum number of iterations per stage.
+        patience, min_delta, tol: The convergence criteria, see loss_plateaued().
+        batch_size: Number of windows (collocation points) per iteration.
+        solver: The solver name, see ode_solver().
+        ilr: The learning rate of the collocation stage.
+        lr_decay: Factor by which the learning rate decays between stages.
+        min_lr: The smallest learning rate of the last stages.
+
+    Returns:
+        model, loss_list, grad_norm, lr_list as NODE_training(), over all stages one after the other.
+        stages: A list with a dict per stage: the name, the batch_time, the number of iterations,
+            the learning rate, the wall time and the final loss (mean of the last patience iterations).
+    """
+    loss_list = []
+    grad_norm = []
+    lr_list = []
+    stages = []
+
+    def record(name, stage_batch_time, lr, start_time, stage_loss, stage_grad, stage_lr):
+        loss_list.extend(stage_loss)
+        grad_norm.extend(stage_grad)
+        lr_list.extend(stage_lr)
+        stages.append({'name': name, 'batch_time': stage_batch_time, 'lr': lr, 'n_iters': len(stage_loss),
+                       'time': time.time() - start_time,
+                       'loss': float(np.mean(np.sum(np.reshape(stage_loss[-patience:], (min(len(stage_loss), patience), -1)), axis=1)))})
+        print('{} stage: {} iterations, {:.1f} s, loss {:.5f}'.format(name, stages[-1]['n_iters'], stages[-1]['time'], stages[-1]['loss']))
+
+    # collocation pre-training
+    if coll_y is None:
+        coll_y, coll_dy = collocate_data_torch(t, true_y, cache=True)
+    start_time = time.time()
+    model, stage_loss, stage_grad, stage_lr = collocation_training(t, coll_y, coll_dy, model, n_iters=max_iters, batch_size=batch_size,
+                                                                   patience=patience, min_delta=min_delta, tol=tol, ilr=ilr, scheduler='constant')
+    record('Collocation', None, ilr, start_time, stage_loss, stage_grad, stage_lr)
+
+    # NODE training, growing the horizon and decaying the learning rate at every plateau
+    max_batch_time = min(max_batch_time, t.size(dim=0))
+    lr = ilr * lr_decay
+    while True:
+        batch_time = min(batch_time, max_batch_time)
+        start_time = time.time()
+        model, stage_loss, stage_grad, stage_lr = NODE_training(t, true_y, model, n_iters=max_iters, batch_time=batch_time, batch_size=batch_size,
+                                                                solver=solver, patience=patience, min_delta=min_delta, tol=tol, ilr=lr, scheduler='constant')
+        record('NODE', batch_time, lr, start_time, stage_loss, stage_grad, stage_lr)
+        if batch_time == max_batch_time and lr * lr_decay < min_lr:
+            break
+        lr *= lr_decay
+        batch_time = int(batch_time * growth)
+
+    return model, loss_list, grad_norm, lr_list, stages
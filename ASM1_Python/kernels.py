@@ -0,0 +1,107 @@
+import numpy as np
+
+### Kernel functions of the local polynomial collocation, evaluated on whole arrays ###
+
+def epanechnikov(u):
+    return np.where(np.abs(u) <= 1, 0.75 * (1 - u**2), 0.0)
+
+def uniform(u):
+    return np.where(np.abs(u) <= 1, 0.5, 0.0)
+
+def triangular(u):
+    return np.where(np.abs(u) <= 1, 1 - np.abs(u), 0.0)
+
+def quartic(u):
+    return np.where(np.abs(u) <= 1, 15 * (1 - u**2)**2 / 16, 0.0)
+
+def triweight(u):
+    return np.where(np.abs(u) <= 1, 35 * (1 - u**2)**3 / 32, 0.0)
+
+def tricube(u):
+    return np.where(np.abs(u) <= 1, 70 * (1 - np.abs(u)**3)**3 / 81, 0.0)
+
+def cosine(u):
+    return np.where(np.abs(u) <= 1, np.pi * np.cos(np.pi * u / 2) / 4, 0.0)
+
+def gaussian(u):
+    return np.exp(-0.5 * u**2) / np.sqrt(2 * np.pi)
+
+def logistic(u):
+    # written with exp(-|u|), so that large |u| does not overflow
+    e = np.exp(-np.abs(u))
+    return e / (1 + e)**2
+
+def sigmoid(u):
+    e = np.exp(-np.abs(u))
+    return 2 * e / (np.pi * (1 + e**2))
+
+def silverman(u):
+    return 0.5 * np.sin(np.abs(u) / 2 + np.pi / 4) * np.exp(-np.abs(u) / np.sqrt(2))
+
+
+# name: (kernel function, support radius), the radius is None for kernels without compact support
+kernel_functions = {
+    "EpanechnikovKernel": (epanechnikov, 1),
+    "UniformKernel": (uniform, 1),
+    "TriangularKernel": (triangular, 1),
+    "QuarticKernel": (quartic, 1),
+    "TriweightKernel": (triweight, 1),
+    "TricubeKernel": (tricube, 1),
+    "CosineKernel": (cosine, 1),
+    "GaussianKernel": (gaussian, None),
+    "LogisticKernel": (logistic, None),
+    "SigmoidKernel": (sigmoid, None),
+    "SilvermanKernel": (silverman, None),
+}
+
+# radius beyond which the kernel (or the envelope of its tail) is below tol times its value at 0
+truncation_radius = {
+    "GaussianKernel": lambda tol: np.sqrt(-2 * np.log(tol)),
+    "LogisticKernel": lambda tol: np.arccosh(2 / tol - 1),
+    "SigmoidKernel": lambda tol: np.arccosh(1 / tol),
+    "SilvermanKernel": lambda tol: np.sqrt(2) * np.log(np.sqrt(2) / tol),
+}
+
+
+def kernel_radius(kernel_str, tol=None):
+    """
+    Returns the support radius of a kernel, in units of the bandwidth.
+
+    Args:
+        kernel_str: The name of the kernel function.
+        tol: Truncates a kernel without compact support where it falls below tol times its peak
+            (default: None, not truncated).
+
+    Returns:
+        The radius, or None for a kernel that is not truncated.
+    """
+    if kernel_str not in kernel_functions:
+        raise ValueError("Wrong kernel function name!")
+
+    radius = kernel_functions[kernel_str][1]
+    if radius is None and tol is not None:
+        if not 0 < tol < 1:
+            raise ValueError("The kernel truncation tolerance must lie in (0, 1)!")
+        radius = float(truncation_radius[kernel_str](tol))
+    return radius
+
+
+def calculate_kernel(kernel_str, t, tol=None):
+    """
+    Calculates the value of the specified kernel function.
+
+    Args:
+        kernel_str: The name of the kernel function.
+        t: The input value(s) of timepoints, a scalar or a numpy array.
+        tol: Truncation tolerance, see kernel_radius() (default: None).
+
+    Returns:
+        The value(s) of the kernel function.
+    """
+    if kernel_str not in kernel_functions:
+        raise ValueError("Wrong kernel function name!")
+
+    k = kernel_functions[kernel_str][0](t)
+    if tol is not None and kernel_functions[kernel_str][1] is None:
+        k = np.where(np.abs(t) <= kernel_radius(kernel_str, tol), k, 0.0)
+    return k
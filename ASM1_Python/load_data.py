@@ -1,8 +1,15 @@
 import numpy as np
 import torch
+import os
+from dataset_io import load_dataset
 
 ## load data from external file in the directory
-def load_data(file_name='ASM_CSTR/ASM1_NODE_package/data/true_y.csv'):
+def load_data(file_name='ASM_CSTR/ASM1_NODE_package/data/true_y.csv', field='true_y'):
+    # a binary dataset directory written by save_dataset() is memory-mapped, no parsing
+    if os.path.isdir(file_name):
+        data, metadata = load_dataset(file_name, names=['t', field])
+        return data['t'], data[field]
+
     read_data = np.loadtxt(fname=file_name, delimiter=",", skiprows=1)
     t = torch.tensor(read_data[:,0], dtype=torch.float32)
     true_y = torch.unsqueeze(torch.tensor(read_data[:,1:],dtype=torch.float32),dim=1)
@@ -0,0 +1,26 @@
+import numpy as np
+
+def loss_plateaued(loss_list, patience=100, min_delta=1e-2, tol=0.0):
+    """
+    Convergence test for early stopping on noisy mini-batch losses.
+
+    Args:
+        loss_list: The recorded losses, one per iteration (lists of member losses are summed).
+        patience: Number of iterations averaged over.
+        min_delta: Smallest relative improvement of the mean loss of the last patience iterations
+            on the mean of the patience iterations before, that counts as progress.
+        tol: Loss below which training counts as converged anyway (default: 0.0, not used).
+
+    Returns:
+        True when the loss has converged.
+    """
+    if len(loss_list) < patience:
+        return False
+    losses = np.sum(np.reshape(loss_list[-2 * patience:], (min(len(loss_list), 2 * patience), -1)), axis=1)
+    recent = np.mean(losses[-patience:])
+    if recent < tol:
+        return True
+    if len(losses) < 2 * patience:
+        return False
+    previous = np.mean(losses[:patience])
+    return recent > (1 - min_delta) * previous
@@ -4,13 +4,21 @@ from plot_data import plot_data
 from estimate_mean_std import estimate_mean_std
 from model_initiation import model_initiation
 from collocate_data_torch import collocate_data_torch
-from collocation_training import collocation_training
+from collocation_training import collocation_training, full_batch_collocation_training, collocation_time_to_target
+from streaming_collocation import streamingCollocation
 from NODE_training import NODE_training
+from training_engine import validation_rmse
+from regularisation import solver_cost, regularisation_effect
+from incremental_training import incremental_training
+from export_model import export_model
+from surrogate_model import export_surrogate
 from validation import validation
+from simulation import simulation
+from parameter_estimation import kinetic_calibration, monte_carlo_simulation
 from plot_loss_grad import plot_loss_grad
 
 # generate trajectory data from mathemetical modelling
-t, true_y, true_dy = IVP_data_generation()
+t, true_y, true_dy = IVP_data_generation(cache=True)
 # plot_data(t, true_y)
 # plot_data(t, true_dy, active_only=True, y_labels=['True dy'], 
 #            unit_name = ['mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 'mg COD/(l.d)', 
@@ -28,10 +36,14 @@ t, true_y, true_dy = IVP_data_generation()
 
 # model initiation
 noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale = estimate_mean_std(t, true_y)
-model = model_initiation(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale)
+model = model_initiation(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale)  # norm='zscore', 'minmax', 'eqscale' or 'none'
+# or a hybrid model: the ASM1 rates with trainable kinetics plus a small neural correction
+# model = model_initiation(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale, width=16, hybrid=True)
 
 # collocation calculation
-coll_y, coll_dy = collocate_data_torch(t, true_y)
+coll_y, coll_dy = collocate_data_torch(t, true_y, cache=True)
+# or with the bandwidth selected by generalised cross-validation, bandwidth='gcv' (or 'loo'), shared or per_state=True
+# coll_y, coll_dy = collocate_data_torch(t, true_y, cache=True, bandwidth='gcv')
 # plot_data(t, coll_y, true_y, y_labels=['Coll Trajectory','True Trajectory'], active_only=True, show_RMSE=True)
 # plot_data(t, coll_dy, true_dy, y_labels=['Coll derivative','True derivative'], active_only=True, show_RMSE=True,
 #           y_name = ['$S_I\'$', '$S_S\'$', '$X_I\'$', '$X_S\'$', '$X_{BH}\'$', '$X_{BA}\'$', '$X_P\'$', '$S_O\'$', '$S_{NO}\'$', '$S_{NH}\'$', '$S_{ND}\'$', '$X_{ND}\'$', '$S_{ALK}\'$', '$S_{N_2}\'$', '$X_{INORG}\'$'],
@@ -39,12 +51,52 @@ coll_y, coll_dy = collocate_data_torch(t, true_y)
 
 # collocation training
 model, loss_list, grad_norm, lr_list = collocation_training(t, coll_y, coll_dy, model)
+# or full-batch L-BFGS on all collocated points, optionally refined by Adam, and its time to a target loss against
+# the minibatch mode, collocation_time_to_target(t, coll_y, coll_dy, model, target_loss=...)
+# model, loss_list, grad_norm, lr_list, elapsed = full_batch_collocation_training(t, coll_y, coll_dy, model, refine_iters=200)
 pred_y = validation(model, t)
 plot_data(t, pred_y, true_y, y_labels=['Prediction','True'], show_RMSE=True)
 plot_loss_grad(loss_list, grad_norm, lr_list)
 
 # NODE training
 model, loss_list, grad_norm, lr_list = NODE_training(t, true_y, model)
+# the loss and learning rate schedule are parameters, and training can stop as soon as the prediction is accurate enough, e.g.
+# NODE_training(t, true_y, model, loss='huber', loss_options={'delta': 0.03}, scheduler='cosine',
+#               validation_fn=validation_rmse(t, true_y), target_rmse=1.0, validate_every=100)
+# regulariser='jacobian', 'kinetic' or 'taylor' with reg_weight penalises stiff learned dynamics; the NFE and wall time
+# of the solve with and without it, on the same batches,
+# regularisation_effect(functools.partial(NODE_training, t, true_y), model, t, true_y[0], 'jacobian',
+#                       sampler_fn=lambda seed: windowSampler(t, true_y, seed=seed))
+# with log_path='result/NODE_log.pt' the telemetry (incl. wall time per phase) is also written during training,
+# e.g. for plot_loss_grad('result/NODE_log.pt')
 pred_y = validation(model, t)
 plot_data(t, pred_y, true_y, y_labels=['Prediction','True'], show_RMSE=True)
-plot_loss_grad(loss_list, grad_norm, lr_list)
\ No newline at end of file
+plot_loss_grad(loss_list, grad_norm, lr_list)
+
+# the trained model with its normalisation folded into the weights, compiled for fast inference
+# pred_y = validation(export_model(model), t)
+
+# a fixed-step surrogate for real-time use, e.g. in a model-predictive controller: one frozen TorchScript module
+# with the normalisation and the integrator, called as surrogate(y0, t) for a batch y0 (S, noFeature),
+# saved for torch.jit.load without this package
+# surrogate, error = export_surrogate(model, 'rk4', t=t, y0=true_y[0], rtol=1e-3, path='result/surrogate.pt')
+
+# what-if scenarios: a batch of initial states (S, noFeature) in one solve, with the RMSE of each against
+# reference trajectories (length(t), S, noFeature), e.g. from IVP_data_generation(true_y0=y0)
+# pred_y, RMSE = simulation(model, t, y0, ref_y, chunk_size=64)
+
+# or the incremental strategy in one go: collocation pre-training, then NODE training on a growing horizon,
+# each stage stopping once its loss has converged
+# model, loss_list, grad_norm, lr_list, stages = incremental_training(t, true_y, model, coll_y, coll_dy)
+# pred_y = validation(model, t)
+# plot_data(t, pred_y, true_y, y_labels=['Prediction','True'], show_RMSE=True)
+# plot_loss_grad(loss_list, grad_norm, lr_list)
+
+# kinetic calibration of the mechanistic model to observed trajectories, and the uncertainty of its predictions
+# from parameter sets sampled around the fit, all integrated in one solve
+# kineP, loss_list, cov = kinetic_calibration(t, true_y)
+# bands, samples = monte_carlo_simulation(t, true_y[0], n_samples=1000, kineP=kineP, cov=cov, quantiles=(0.05, 0.5, 0.95))
+
+# online collocation of measured data, chunk by chunk, with a fixed latency of one kernel radius
+# stream = streamingCollocation(h=0.01)
+# t_chunk, coll_y_chunk, coll_dy_chunk = stream.update(t_new, y_new)  # then e.g. collocation_training on the chunk
@@ -1,7 +1,26 @@
 from NODE_model import neuralODE
+from ensemble_model import ensembleODE
+from mechanistic_model import mechanisticODE
+from hybrid_model import hybridODE
+from default_stoichiometric_kinetic_value import default_stoichimetric_kinetic_value
 
-def model_initiation(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale):
+def model_initiation(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale, n_members=1, norm='zscore', width=50,
+    hybrid=False, freeze_mechanistic=False, freeze_neural=False):
 
-    model = neuralODE(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale)
+    # n_members > 1 gives an ensemble of independently initialised replicas, trained together
+    if n_members > 1:
+        if hybrid or freeze_mechanistic or freeze_neural:
+            raise ValueError("An ensemble holds neuralODE members only, hybrid models are trained one by one!")
+        return ensembleODE([neuralODE(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale, norm, width) for _ in range(n_members)])
 
-    return model
\ No newline at end of file
+    # norm: 'none', 'zscore', 'minmax' or 'eqscale', see neuralODE.normalisation()
+    model = neuralODE(noFeature, yMu, yStd, dyMu, dyStd, yMax, yMin, dyMax, dyMin, ytScale, norm, width)
+
+    # hybrid=True: the ASM1 rates with the default kinetics, plus the neuralODE as a correction, see hybridODE;
+    # a much smaller width suffices then, e.g. width=16
+    if hybrid:
+        stoiP, kineP, _ = default_stoichimetric_kinetic_value()
+        mechanistic = mechanisticODE(noFeature, kineP.to(yMu.dtype), stoiP.to(yMu.dtype))
+        model = hybridODE(mechanistic, model, freeze_mechanistic, freeze_neural)
+
+    return model
@@ -0,0 +1,75 @@
+import torch
+from ode_solver import ode_solver
+from training_engine import training_engine
+
+def multiple_shooting_training(t, true_y, model, n_iters=2000, segment_time=16, learn_starts=True, continuity_weight=1.0, solver='dopri5',
+    log_path=None, loss='mae', loss_options=None, scheduler='step', scheduler_options=None):
+    """
+    Trains a NODE by multiple shooting: the trajectories are split into consecutive segments of
+    segment_time points, sharing their end points, and all segments are integrated in parallel as
+    one batch over t[:segment_time]. Where the segments do not tile the trajectory, a last segment
+    overlapping the one before ends at the last time point. Every iteration thus uses the whole
+    trajectory at the cost of a short integration.
+
+    Args:
+        t: A torch list of equally spaced time points.
+        true_y: A torch tensor with dimension (length(t), 1, number_of_features),
+            or (length(t), number_of_trajectories, number_of_features).
+        model: The neuralODE to train.
+        n_iters: Number of iterations.
+        segment_time: Number of time points per segment.
+        learn_starts: Train the segment start states as free parameters, initialised from the data
+            (default: True), or start every segment from the observed state.
+        continuity_weight: Weight of the penalty on the gap between the end of a segment and the
+            start of the next one.
+        solver: The solver name, see ode_solver().
+        log_path: Writes the telemetry of the run to this file, see trainingTelemetry (default: None).
+        loss, loss_options, scheduler, scheduler_options: The loss of the segments (default: MAE) and the
+            learning rate schedule, see training_engine().
+
+    Returns:
+        model, loss_list, grad_norm, lr_list as NODE_training(), and the segment starts.
+    """
+    nf = true_y.size(dim=true_y.ndim-1)
+    y = true_y.reshape(true_y.size(dim=0), -1, nf)
+    n_traj = y.size(dim=1)
+
+    # segments k(L-1) ... k(L-1)+L-1, as (segment_time, n_segment * n_traj, 1, nf), segment-major,
+    # plus one over the last L points if the others stop short of the end
+    segments = y.unfold(0, segment_time, segment_time - 1)
+    starts_at = torch.arange(segments.size(dim=0)) * (segment_time - 1)
+    if starts_at[-1] + segment_time < y.size(dim=0):
+        segments = torch.cat((segments, y[-segment_time:].permute(1, 2, 0).unsqueeze(0)))
+        starts_at = torch.cat((starts_at, torch.tensor([y.size(dim=0) - segment_time])))
+    n_segment = segments.size(dim=0)
+    # the point of every segment where the next one starts, segment_time - 1 but for the overlapping one
+    gap_index = starts_at[1:] - starts_at[:-1]
+    batch_y = segments.permute(3, 0, 1, 2).reshape(segment_time, n_segment * n_traj, 1, nf)
+    batch_t = t[:segment_time]
+
+    # learned starts are the observed ones plus an offset in units of the standard deviation of each
+    # state, so that the optimizer steps are on the same scale for all states (constant states stay fixed)
+    observed_starts = batch_y[0].clone()
+    start_scale = torch.std(y.reshape(-1, nf), dim=0)
+    start_offset = torch.zeros_like(observed_starts, requires_grad=learn_starts)
+
+    params = [{'params': model.parameters()}]
+    if learn_starts:
+        params.append({'params': [start_offset]})
+
+    def forward(batch):
+        # all segments in one solve
+        starts = observed_starts + start_offset * start_scale
+        pred_y = ode_solver(model, starts, batch_t, method=solver)
+
+        # the loss of the segments, plus the (MAE) continuity gaps between segments of the same trajectory
+        penalty = 0.0
+        if n_segment > 1:
+            ends = pred_y.view(segment_time, n_segment, n_traj, nf)[gap_index, torch.arange(n_segment - 1)]
+            next_starts = starts.view(n_segment, n_traj, nf)[1:]
+            penalty = continuity_weight * torch.mean(torch.abs(ends - next_starts))
+        return pred_y.reshape(1, -1, nf), batch_y.reshape(1, -1, nf), penalty
+
+    model, loss_list, grad_norm, lr_list, _ = training_engine(model, lambda: None, forward, n_iters, 'multiple shooting', params=params,
+        loss=loss, loss_options=loss_options, scheduler=scheduler, scheduler_options=scheduler_options, log_path=log_path)
+    return model, loss_list, grad_norm, lr_list, (observed_starts + start_offset * start_scale).detach()
@@ -0,0 +1,399 @@
+import bisect
+import math
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+from torchdiffeq import odeint, odeint_adjoint
+
+def ode_solver(func, y0, t, method='dopri5', rtol=None, atol=None, options=None,
+    gradient='direct', adjoint_method=None, adjoint_options=None, n_segments=4):
+    """
+    Solves an IVP either with a torchdiffeq solver (e.g. 'dopri5', 'rk4', 'scipy_solver'),
+    or with one of the native implicit solvers below for stiff problems (e.g. 'rosenbrock23').
+
+    Args:
+        func: The right-hand side func(t, y), e.g. a neuralODE or a mechanisticODE.
+        y0: A torch tensor of initial states, the last dimension holds the features.
+        t: A torch list of ascending time points.
+        method: The solver name (default: 'dopri5').
+        rtol, atol: Relative and absolute tolerances (default: None, those of solver_tolerances()).
+        options: A dict of solver options.
+        gradient: How gradients are computed (default: 'direct'):
+            'direct' backpropagates through every internal solver step,
+            'adjoint' solves the adjoint ODE backwards in time, with adjoint_method/adjoint_options for
+                the backward solve. For a native implicit solver, e.g. method='rosenbrock23', the adjoints
+                are solved by the same solver along the forward trajectory, see stiff_adjoint(), which
+                needs state-sized Jacobians only; a torchdiffeq solver takes e.g. adjoint_method='scipy_solver'
+                and adjoint_options={'solver': 'BDF'}, but scipy approximates the Jacobian of the augmented
+                system (states, adjoints and parameter gradients) by finite differences, which is practical
+                for few parameters only, e.g. a mechanisticODE,
+            'checkpoint' splits t into n_segments, keeps only the segment boundaries and
+                recomputes the steps inside a segment during backpropagation.
+
+    Returns:
+        The solution with dimension (length(t), *y0.shape).
+    """
+    rtol, atol = solver_tolerances(method, rtol, atol)
+
+    if gradient == 'adjoint':
+        if method in stiff_solvers:
+            return stiff_adjoint(func, y0, t, method, rtol, atol, options, adjoint_method, adjoint_options)
+        if adjoint_method in stiff_solvers:
+            raise ValueError("Solve forward with {} as well for its adjoint, method='{}'!".format(adjoint_method, adjoint_method))
+        return odeint_adjoint(func, y0, t, rtol=rtol, atol=atol, method=method, options=options,
+                              adjoint_method=adjoint_method, adjoint_options=adjoint_options)
+
+    if gradient == 'checkpoint':
+        return checkpointed_solver(func, y0, t, method, rtol, atol, options, n_segments)
+
+    if gradient != 'direct':
+        raise ValueError("Wrong gradient mode!")
+
+    if method in stiff_solvers:
+        return stiff_solvers[method](func, y0, t, rtol=rtol, atol=atol, **(options or {}))
+    return odeint(func, y0, t, rtol=rtol, atol=atol, method=method, options=options)
+
+
+def solver_tolerances(method, rtol=None, atol=None):
+    """
+    Returns the tolerances of a solver, the given ones or its defaults: 1e-7/1e-9 for the torchdiffeq
+    solvers, and the looser ones of stiff_tolerances for the native implicit solvers, whose low order
+    needs many more steps than dopri5 at tight tolerances.
+    """
+    default_rtol, default_atol = stiff_tolerances.get(method, (1e-7, 1e-9))
+    return default_rtol if rtol is None else rtol, default_atol if atol is None else atol
+
+
+def checkpointed_solver(func, y0, t, method='dopri5', rtol=1e-7, atol=1e-9, options=None, n_segments=4):
+    """
+    Solves the IVP segment by segment under gradient checkpointing, so the memory of the
+    autograd graph grows with n_segments rather than with the number of solver steps.
+    The solver restarts at every segment boundary.
+    """
+    bounds = torch.linspace(0, len(t) - 1, n_segments + 1).round().long().unique().tolist()
+
+    def solve_segment(y, t_segment):
+        return ode_solver(func, y, t_segment, method=method, rtol=rtol, atol=atol, options=options)
+
+    solution = [y0.unsqueeze(0)]
+    y = y0
+    for k0, k1 in zip(bounds[:-1], bounds[1:]):
+        y_segment = checkpoint(solve_segment, y, t[k0:k1 + 1], use_reentrant=False)
+        solution.append(y_segment[1:])
+        y = y_segment[-1]
+
+    return torch.cat(solution, dim=0)
+
+
+def stiff_adjoint(func, y0, t, method='rosenbrock23', rtol=1e-4, atol=1e-6, options=None,
+    adjoint_method=None, adjoint_options=None):
+    """
+    Solves the IVP with a native implicit solver and computes the gradients by the adjoint method.
+
+    The states are not integrated backwards, which is unstable for a stiff system; the forward solve keeps
+    the states of its accepted steps instead, and the adjoints a, with da/dt = -a df/dy, are solved backwards
+    along their cubic Hermite interpolant by adjoint_method (default: method), from one time point of t to the
+    previous. The adjoint system is linear with the Jacobian -(df/dy)^T of the states, so the implicit solver
+    needs state-sized Jacobians only, and the parameter gradients, the integral of a df/dparameters, are
+    summed by the trapezoidal rule over the accepted backward steps with one vector-Jacobian product each.
+    Features that are constant whatever the state (see denseTrajectory.inert_features()) are left out of
+    the adjoint solve and summed alongside the parameter gradients, and the adjoints are solved scaled to
+    a maximum of one on every interval, so that the tolerances apply to them as to the states.
+    The memory grows with batch size and forward steps by the states only.
+
+    Returns:
+        The solution with dimension (length(t), *y0.shape).
+    """
+    adjoint_method = method if adjoint_method is None else adjoint_method
+    if adjoint_method not in stiff_solvers:
+        raise ValueError("The adjoint of {} is solved by a native implicit solver, not {}!".format(method, adjoint_method))
+    params = tuple(p for p in func.parameters() if p.requires_grad) if isinstance(func, nn.Module) else ()
+    return stiffAdjoint.apply(func, t, y0, method, rtol, atol, options, adjoint_method, adjoint_options, *params)
+
+
+class denseTrajectory:
+
+    def __init__(self, func):
+        """
+        Passes a right-hand side to a native implicit solver and keeps the states of the accepted steps,
+        from which state(t) interpolates the trajectory.
+        """
+        self.func = func
+        if hasattr(func, 'jacobian'):
+            self.jacobian = func.jacobian
+        self.times = []
+        self.states = []
+        self.slopes = {}
+
+    def __call__(self, t, y):
+        return self.func(t, y)
+
+    def callback_accept_step(self, t0, y0, dt):
+        self.times.append(float(t0))
+        self.states.append(y0.detach())
+        if hasattr(self.func, 'callback_accept_step'):
+            self.func.callback_accept_step(t0, y0, dt)
+
+    def callback_reject_step(self, t0, y0, dt):
+        if hasattr(self.func, 'callback_reject_step'):
+            self.func.callback_reject_step(t0, y0, dt)
+
+    def close(self, t1, y1):
+        # the end point of the last step
+        self.times.append(float(t1))
+        self.states.append(y1.detach())
+
+    def slope(self, k):
+        if k not in self.slopes:
+            with torch.no_grad():
+                self.slopes[k] = self.func(torch.tensor(self.times[k]), self.states[k])
+        return self.slopes[k]
+
+    def inert_features(self):
+        """
+        Returns the features whose rates and Jacobian rows vanish, e.g. those without variance in the data
+        under 'zscore' normalisation. Their adjoints do not act on the others or on the parameters, but
+        their Jacobian columns, scaled by the inverse of a zero variance, would dominate the adjoint solve.
+        """
+        rates = torch.stack([self.slope(k) for k in range(len(self.times))])
+        J = batched_jacobian(self.func, torch.tensor(self.times[0]), self.states[0])
+        nf = J.size(dim=-1)
+        return (rates.reshape(-1, nf) == 0).all(dim=0) & (J.reshape(-1, nf, nf) == 0).all(dim=2).all(dim=0)
+
+    def state(self, t):
+        # cubic Hermite interpolation between the accepted steps
+        k = min(max(bisect.bisect_right(self.times, t) - 1, 0), len(self.times) - 2)
+        h = self.times[k + 1] - self.times[k]
+        s = (t - self.times[k]) / h
+        return ((1 + 2 * s) * (1 - s) ** 2 * self.states[k] + s * (1 - s) ** 2 * h * self.slope(k)
+                + s ** 2 * (3 - 2 * s) * self.states[k + 1] + s ** 2 * (s - 1) * h * self.slope(k + 1))
+
+
+class adjointSystem:
+
+    def __init__(self, func, trajectory, params, active, scale):
+        """
+        The adjoint ODE of func along a denseTrajectory in reversed time s = -t, da/ds = a df/dy, of the
+        active features only. Being linear, it is solved for b = a / scale, which keeps the adjoints of
+        order one for the error control. Records the adjoints of the accepted steps for the quadratures.
+        """
+        self.func = func
+        self.trajectory = trajectory
+        self.params = params
+        self.active = active
+        self.scale = scale
+        self.times = []
+        self.adjoints = []
+
+    def full(self, b):
+        # the adjoints of all features, zero for the inert ones
+        a = b.new_zeros(*b.shape[:-1], self.active.numel())
+        a[..., self.active] = b
+        return a
+
+    def __call__(self, s, b):
+        t = -s
+        with torch.enable_grad():
+            y = self.trajectory.state(float(t)).requires_grad_(True)
+            return torch.autograd.grad(self.func(t, y), y, self.full(b))[0][..., self.active]
+
+    def jacobian(self, s, b):
+        t = -s
+        J = batched_jacobian(self.func, t, self.trajectory.state(float(t)))
+        return J[:, self.active][:, :, self.active].transpose(1, 2)
+
+    def callback_accept_step(self, s0, b0, ds):
+        self.times.append(-float(s0))
+        self.adjoints.append(b0.detach())
+
+    def quadratures(self, t1, b1):
+        """
+        Returns the integrals of a df/dy and of a df/dparameters over the accepted steps and the end point t1,
+        by the trapezoidal rule; the former carries the adjoints of the inert features.
+        """
+        times, adjoints = self.times + [t1], self.adjoints + [b1]
+        integrals = None
+        previous = None
+        for k, (t, b) in enumerate(zip(times, adjoints)):
+            with torch.enable_grad():
+                y = self.trajectory.state(t).requires_grad_(True)
+                inputs = (y, *self.params)
+                current = torch.autograd.grad(self.func(torch.tensor(t), y), inputs, self.full(b) * self.scale, allow_unused=True)
+            current = [torch.zeros_like(x) if q is None else q for q, x in zip(current, inputs)]
+            if previous is None:
+                integrals = [torch.zeros_like(q) for q in current]
+            else:
+                h = times[k - 1] - t
+                for integral, q0, q1 in zip(integrals, previous, current):
+                    integral += 0.5 * h * (q0 + q1)
+            previous = current
+        return integrals
+
+
+class stiffAdjoint(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, func, t, y0, method, rtol, atol, options, adjoint_method, adjoint_options, *params):
+        trajectory = denseTrajectory(func)
+        solution = stiff_solvers[method](trajectory, y0, t, rtol=rtol, atol=atol, **(options or {}))
+        trajectory.close(t[-1], solution[-1])
+        ctx.func, ctx.trajectory, ctx.params = func, trajectory, params
+        ctx.rtol, ctx.atol, ctx.adjoint_method, ctx.adjoint_options = rtol, atol, adjoint_method, adjoint_options
+        ctx.save_for_backward(t)
+        return solution
+
+    @staticmethod
+    def backward(ctx, grad_y):
+        t, = ctx.saved_tensors
+        t_list = t.tolist()
+        grad_params = [torch.zeros_like(p) for p in ctx.params]
+        # the inert features are left out of the adjoint solve, their adjoints are integrated alongside
+        active = ~ctx.trajectory.inert_features()
+        a = grad_y[-1]
+        for i in range(len(t_list) - 1, 0, -1):
+            scale = a[..., active].abs().max() if active.any() else 0.0
+            if scale > 0:
+                system = adjointSystem(ctx.func, ctx.trajectory, ctx.params, active, scale)
+                s = t.new_tensor([-t_list[i], -t_list[i - 1]])
+                b1 = stiff_solvers[ctx.adjoint_method](system, a[..., active] / scale, s, rtol=ctx.rtol, atol=ctx.atol,
+                                                       **(ctx.adjoint_options or {}))[-1]
+                grad_state, *grads = system.quadratures(t_list[i - 1], b1)
+                for g, q in zip(grad_params, grads):
+                    g += q
+                a = a + torch.where(active, system.full(b1) * scale - a, grad_state)
+            a = a + grad_y[i - 1]
+        return (None, None, a, None, None, None, None, None, None, *grad_params)
+
+
+def batched_jacobian(func, t, y):
+    """
+    Computes the Jacobians df/dy of a right-hand side whose leading dimensions are independent
+    samples (states, scenarios, batch members) and whose last dimension holds the features.
+    A model can supply an analytic Jacobian through a `jacobian(t, y)` method.
+
+    Args:
+        func: The right-hand side func(t, y).
+        t: The time point.
+        y: A torch tensor of states.
+
+    Returns:
+        J: A torch tensor with dimension (number_of_samples, number_of_features, number_of_features).
+    """
+    if hasattr(func, 'jacobian'):
+        return func.jacobian(t, y)
+
+    nf = y.size(dim=-1)
+    with torch.enable_grad():
+        y = y.detach().requires_grad_(True)
+        f = func(t, y).reshape(y.shape)
+        # one vector-Jacobian product per feature, vectorized over the batch
+        basis = torch.eye(nf, dtype=y.dtype).view(nf, *([1] * (y.ndim - 1)), nf).expand(nf, *y.shape)
+        J = torch.autograd.grad(f, y, basis, is_grads_batched=True)[0]
+    return J.reshape(nf, -1, nf).transpose(0, 1)
+
+
+def rosenbrock23(func, y0, t, rtol=1e-4, atol=1e-6, first_step=None, max_num_steps=10**6):
+    """
+    Linearly implicit, L-stable Rosenbrock method of order 2(3), as in MATLAB ode23s
+    (Shampine & Reichelt, "The MATLAB ODE suite", 1997), with adaptive steps and the
+    free second-order interpolant for the output time points.
+
+    The Jacobian is computed with batched_jacobian() once per step and kept out of the
+    autograd graph, so backpropagation goes through the function evaluations and the linear
+    solves only, as for a W-method. The time derivative df/dt is neglected since the ASM1
+    and NODE right-hand sides are autonomous. Like the torchdiffeq solvers, it calls the
+    callback_accept_step/callback_reject_step methods of func if it has them.
+
+    Being of order 2 only, it pays off at loose tolerances: over one day of ASM1 it needs about a
+    quarter of the function evaluations of dopri5 at rtol 1e-4, but on the default run about three
+    times more at rtol 1e-7, hence its looser defaults, see stiff_tolerances.
+
+    Returns:
+        The solution with dimension (length(t), *y0.shape).
+    """
+    d = 1 / (2 + math.sqrt(2))
+    e32 = 6 + math.sqrt(2)
+
+    shape = y0.shape
+    nf = shape[-1]
+    t_list = t.tolist()
+
+    def f(ti, y):
+        return func(t.new_tensor(ti), y.reshape(shape)).reshape(-1, nf)
+
+    def solve(lu, rhs):
+        return torch.linalg.lu_solve(*lu, rhs.unsqueeze(-1)).squeeze(-1)
+
+    def rms(x):
+        return torch.sqrt(torch.mean(x ** 2)).item()
+
+    y = y0.reshape(-1, nf)
+    t0 = t_list[0]
+    F0 = f(t0, y)
+    eye = torch.eye(nf, dtype=y.dtype)
+
+    if first_step is None:
+        scale = atol + rtol * torch.abs(y)
+        d0, d1 = rms(y / scale), rms(F0 / scale)
+        h = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01 * d0 / d1
+        # a step that t0 + h can still resolve
+        h = max(h, 1e-12 * abs(t_list[-1] - t0))
+    else:
+        h = first_step
+
+    solution = [y0]
+    j = 1
+    n_steps = 0
+    J = None
+    while j < len(t_list):
+        if n_steps >= max_num_steps:
+            raise RuntimeError('max_num_steps exceeded ({}>={})'.format(n_steps, max_num_steps))
+        n_steps += 1
+        if t0 + h <= t0:
+            raise RuntimeError('step size underflow at t={}'.format(t0))
+
+        # land exactly on the final time point
+        t_new = t_list[-1] if t0 + h >= t_list[-1] else t0 + h
+        h = t_new - t0
+        if J is None:
+            J = batched_jacobian(func, t.new_tensor(t0), y.reshape(shape)).detach()
+        lu = torch.linalg.lu_factor(eye - h * d * J)
+
+        k1 = solve(lu, F0)
+        F1 = f(t0 + 0.5 * h, y + 0.5 * h * k1)
+        k2 = solve(lu, F1 - k1) + k1
+        y_new = y + h * k2
+        F2 = f(t_new, y_new)
+        k3 = solve(lu, F2 - e32 * (k2 - F1) - 2 * (k1 - F0))
+
+        scale = atol + rtol * torch.maximum(torch.abs(y), torch.abs(y_new))
+        err = rms(h / 6 * (k1 - 2 * k2 + k3) / scale)
+
+        if err <= 1:
+            if hasattr(func, 'callback_accept_step'):
+                func.callback_accept_step(t.new_tensor(t0), y.reshape(shape), t.new_tensor(h))
+            # fill the output time points covered by this step with the interpolant
+            while j < len(t_list) and t_list[j] <= t_new:
+                s = (t_list[j] - t0) / h
+                y_out = y + h * (s * (1 - s) / (1 - 2 * d) * k1 + s * (s - 2 * d) / (1 - 2 * d) * k2)
+                solution.append(y_out.reshape(shape))
+                j += 1
+            y, t0, F0 = y_new, t_new, F2
+            J = None
+        elif hasattr(func, 'callback_reject_step'):
+            func.callback_reject_step(t.new_tensor(t0), y.reshape(shape), t.new_tensor(h))
+
+        h = h * min(5., max(0.2, 0.8 * err ** (-1 / 3))) if err > 0 else 5. * h
+
+    return torch.stack(solution, dim=0)
+
+
+# native implicit solvers, selectable by name in ode_solver()
+stiff_solvers = {
+    'rosenbrock23': rosenbrock23,
+}
+
+# default (rtol, atol) of the native implicit solvers, looser, like those of MATLAB ode23s
+stiff_tolerances = {
+    'rosenbrock23': (1e-4, 1e-6),
+}
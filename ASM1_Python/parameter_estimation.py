@@ -0,0 +1,169 @@
+### Kinetic parameter estimation and Monte Carlo uncertainty propagation ###
+import torch
+import torch.autograd.forward_ad as fwAD
+from torch.func import functional_call
+from ode_solver import ode_solver
+from mechanistic_model import mechanisticODE
+from simulation import simulation
+from default_stoichiometric_kinetic_value import default_stoichimetric_kinetic_value
+
+def kinetic_calibration(t, true_y, kineP=None, fit=None, n_iters=50, solver='dopri5', rtol=1e-7, atol=1e-9, tol=1e-6):
+    """
+    Fits the kinetic parameters of the ASM1 model to observed trajectories by Levenberg-Marquardt,
+    with the Jacobian from forward sensitivities: the states are integrated together with their
+    derivatives with respect to the parameters, dS/dt = df/dy S + df/dp, for all scenarios in one solve.
+    A trial step on which the solver fails counts as rejected, the damping is increased.
+    The parameters are fitted as log factors on kineP, so they stay positive and move alike whatever
+    their magnitude, and the residuals are scaled by the standard deviation of every feature.
+
+    Args:
+        t: A torch list of ascending time points.
+        true_y: Observed trajectories with dimension (length(t), S, number_of_features) or
+            (length(t), number_of_features); the first time point is taken as the initial state.
+        kineP: The initial guess of the 16 kinetic parameters (default: None, the default values).
+        fit: Indices of the parameters to fit, in the order of default_stoichimetric_kinetic_value()
+            (default: None, all 16); the others are kept at kineP.
+        n_iters: Maximum number of iterations.
+        solver: The solver name, see ode_solver().
+        rtol, atol: Relative and absolute tolerances.
+        tol: Stops once the loss decreases by less than tol relative.
+
+    Returns:
+        kineP: The fitted kinetic parameters, dimension (16,).
+        loss_list: The loss of every iteration.
+        cov: The covariance of the fitted log factors, dimension (16, 16), zero for the parameters
+            not fitted; e.g. for monte_carlo_simulation(cov=cov).
+    """
+    stoiP, default_kineP, _ = default_stoichimetric_kinetic_value()
+    k0 = (default_kineP if kineP is None else kineP).double()
+    noParameter = k0.size(dim=0)
+    fit = torch.arange(noParameter) if fit is None else torch.as_tensor(fit)
+
+    noFeature = true_y.size(dim=true_y.ndim-1)
+    obs = true_y.double().reshape(len(t), -1, noFeature)
+    noScenario = obs.size(dim=1)
+    y0 = obs[0].view(noScenario, 1, noFeature)
+
+    # residual weights, features constant in the data (e.g. S_O) do not count, and those that vary only
+    # at the rounding level of the data (e.g. X_I) are scaled by 1e-3 of their magnitude instead
+    std = torch.std(obs, dim=(0, 1))
+    scale = torch.maximum(std, 1e-3 * torch.mean(obs.abs(), dim=(0, 1)))
+    weight = torch.where(std > 0, 1.0 / scale, torch.zeros_like(scale))
+
+    # a copy, the kinetics of the model are overwritten at every solve while k0 stays the reference
+    model = mechanisticODE(noFeature, k0.clone(), stoiP.to(k0.dtype)).requires_grad_(False)
+    basis = torch.eye(noParameter, dtype=torch.float64)[fit]
+    noFit = len(fit)
+
+    def sensitivity_ode(ti, z):
+        # z holds the states and their sensitivities to the fitted log factors, (S, 1, nf * (1 + P))
+        y, sens = z[..., :noFeature], z[..., noFeature:].reshape(noScenario, noFeature, noFit)
+        k = model.kinetic.detach()
+        # df/dy S + df/dp in one forward-mode pass over P copies of the states, copy j with the
+        # direction of parameter j and its own kinetic set (see mechanisticODE.process_rates())
+        with fwAD.dual_level():
+            y_dual = fwAD.make_dual(y.reshape(1, noScenario, noFeature).repeat(noFit, 1, 1).reshape(-1, 1, noFeature),
+                                    sens.permute(2, 0, 1).reshape(-1, 1, noFeature))
+            k_dual = fwAD.make_dual(k.repeat(noFit * noScenario, 1), (basis * k).repeat_interleave(noScenario, dim=0))
+            dy, dy_sens = fwAD.unpack_dual(functional_call(model, {'kinetic': k_dual}, (ti, y_dual)))
+        dy_sens = dy_sens.view(noFit, noScenario, noFeature).permute(1, 2, 0)
+        return torch.cat((dy[:noScenario].reshape(noScenario, -1), dy_sens.reshape(noScenario, -1)), dim=-1).view(z.shape)
+
+    def residual(k, sensitivities=False):
+        model.kinetic.copy_(k)
+        with torch.no_grad():
+            if not sensitivities:
+                pred_y = ode_solver(model, y0, t, method=solver, rtol=rtol, atol=atol).view(len(t), noScenario, noFeature)
+                return ((pred_y - obs) * weight).flatten(), None
+            z0 = torch.cat((y0, torch.zeros(noScenario, 1, noFeature * noFit, dtype=torch.float64)), dim=-1)
+            z = ode_solver(sensitivity_ode, z0, t, method=solver, rtol=rtol, atol=atol).view(len(t), noScenario, -1)
+        pred_y, sens = z[..., :noFeature], z[..., noFeature:].reshape(len(t), noScenario, noFeature, -1)
+        return ((pred_y - obs) * weight).flatten(), (sens * weight.view(-1, 1)).reshape(-1, len(fit))
+
+    print("Starting kinetic calibration.")
+    theta = torch.zeros(len(fit), dtype=torch.float64)
+    lam = 1e-2
+    r, J = residual(k0, sensitivities=True)
+    loss_list = [torch.mean(r ** 2).item()]
+    for it in range(1, n_iters + 1):
+        H, g = J.T @ J, J.T @ r
+        damping = torch.diag(H).clamp_min(1e-12 * torch.diag(H).max())
+        while True:
+            step = torch.linalg.solve(H + lam * torch.diag(damping), -g)
+            try:
+                r_trial, _ = residual(k0 * torch.exp(basis.T @ (theta + step)))
+                loss = torch.mean(r_trial ** 2).item()
+            except (AssertionError, RuntimeError):
+                # the solver failed on the trial parameters (e.g. a step size underflow), a rejected step
+                loss = float('inf')
+            if loss < loss_list[-1] or lam > 1e8:
+                break
+            lam *= 10.0
+        if loss >= loss_list[-1]:
+            break
+        theta, lam = theta + step, max(lam / 10.0, 1e-8)
+        loss_list.append(loss)
+        print('Iter: {}, loss: {:.6f}'.format(it, loss))
+        if loss_list[-2] - loss < tol * loss_list[-2]:
+            break
+        r, J = residual(k0 * torch.exp(basis.T @ theta), sensitivities=True)
+
+    kineP = k0 * torch.exp(basis.T @ theta)
+    # Gauss-Newton covariance of the log factors, sigma^2 (J^T J)^-1
+    if len(loss_list) > 1:
+        r, J = residual(kineP, sensitivities=True)
+    dof = max(r.numel() - len(fit), 1)
+    cov = basis.T @ (torch.sum(r ** 2) / dof * torch.linalg.pinv(J.T @ J)) @ basis
+    print("Kinetic calibration finished.")
+
+    return kineP, loss_list, cov
+
+
+def monte_carlo_simulation(t, y0, n_samples=1000, kineP=None, cv=0.1, cov=None, quantiles=(0.05, 0.5, 0.95),
+    solver='dopri5', chunk_size=None, seed=None):
+    """
+    Propagates the uncertainty of the kinetic parameters: samples n_samples parameter sets around kineP,
+    integrates them all as a batch of scenarios of one initial state, and returns quantile bands per state.
+
+    Args:
+        t: A torch list of ascending time points.
+        y0: The initial state, dimension (number_of_features,) or (1, number_of_features).
+        n_samples: Number of parameter sets.
+        kineP: The centre of the samples (default: None, the default values).
+        cv: Coefficient of variation of the parameters, sampled log-normal and independent.
+        cov: Alternatively, the covariance (16, 16) of the log factors, e.g. from kinetic_calibration().
+        quantiles: The quantiles of the bands.
+        solver: The solver name, see ode_solver().
+        chunk_size: Number of parameter sets per solve (default: None, all in one), see simulation().
+        seed: The seed of the samples (default: None).
+
+    Returns:
+        bands: The quantiles of the predictions with dimension (len(quantiles), length(t), number_of_features).
+        samples: The sampled kinetic parameters, dimension (n_samples, 16).
+    """
+    stoiP, default_kineP, _ = default_stoichimetric_kinetic_value()
+    kineP = default_kineP if kineP is None else kineP
+    generator = None if seed is None else torch.Generator().manual_seed(seed)
+
+    noFeature = y0.size(dim=y0.ndim-1)
+    noParameter = kineP.size(dim=0)
+    z = torch.randn(n_samples, noParameter, dtype=torch.float64, generator=generator)
+    if cov is not None:
+        # symmetric square root, as the parameters not fitted leave cov singular
+        eigenvalue, eigenvector = torch.linalg.eigh(cov.double())
+        z = z @ (eigenvector * eigenvalue.clamp_min(0.0).sqrt()).T
+    else:
+        z = z * cv
+    samples = kineP.double() * torch.exp(z)
+
+    pred_y = simulation(mechanisticODE(noFeature, samples, stoiP.to(samples.dtype)), t, y0.double().reshape(1, noFeature).repeat(n_samples, 1),
+                        solver=solver, chunk_size=chunk_size)
+
+    # linear interpolation between the order statistics, as torch.quantile, which is limited in size
+    sorted_y = torch.sort(pred_y, dim=1).values
+    position = torch.tensor(quantiles, dtype=torch.float64) * (n_samples - 1)
+    lower, upper = position.floor().long(), position.ceil().long()
+    frac = (position - lower).view(1, -1, 1).to(sorted_y.dtype)
+    bands = sorted_y[:, lower] * (1 - frac) + sorted_y[:, upper] * frac
+
+    return bands.transpose(0, 1), samples
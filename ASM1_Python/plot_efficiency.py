@@ -1,8 +1,14 @@
 import seaborn as sns
 import pandas as pd
 import matplotlib.pyplot as plt
+import os
 
-eff_data = pd.read_csv('ASM_CSTR/ASM1_NODE_package-upload/data/efficiency_test.csv',index_col=0)
+# the published results; efficiency_test() writes its runs to data/efficiency_test_runs.csv
+eff_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'efficiency_test.csv')
+# eff_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'efficiency_test_runs.csv')
+eff_data = pd.read_csv(eff_file,index_col=0)
+# the seed of a run is no measurement
+eff_data = eff_data.drop(columns=['Seed'], errors='ignore')
 # print(eff_data)
 
 mean_std = eff_data.agg(['mean','std'])
@@ -1,6 +1,11 @@
 from matplotlib import pyplot as plt
+from training_telemetry import load_telemetry
+
+def plot_loss_grad(loss_list,grad_norm=None,lr_list=None):
+    # loss_list may also be the path of a telemetry log, see trainingTelemetry
+    if isinstance(loss_list, str):
+        loss_list, grad_norm, lr_list, _ = load_telemetry(loss_list)
 
-def plot_loss_grad(loss_list,grad_norm,lr_list):
     # Plot loss
     fig, ax1 = plt.subplots(figsize=(6, 4))
     ax2 = ax1.twinx()
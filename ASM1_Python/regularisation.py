@@ -0,0 +1,164 @@
+import copy
+import time
+import numpy as np
+import torch
+from ode_solver import ode_solver
+from solver_stats import instrumentedODE
+
+### Regularisers of the learned vector field that keep it cheap to integrate ###
+
+# Each returns the penalty of every state of a batch y (N, 1, number_of_features), differentiable
+# with respect to the parameters of the model, refer to Finlay: "How to train your neural ODE" and
+# Kelly: "Learning differential equations that are easy to solve". The penalties are taken in
+# normalised coordinates, the states divided by y_scale and the derivatives by dy_scale, see
+# normalisation_scales(), so that one weight suits all features; features constant in the data are left out.
+
+def normalisation_scales(model):
+    """
+    Returns the scales of the penalties from the statistics of the neuralODE of the model.
+
+    Returns:
+        y_scale: The standard deviation of the states, dimension (number_of_features,).
+        dy_scale: The range of the states per time span (ytscale, as the 'eqscale' normalisation),
+            rather than the standard deviation of the differences, which depends on the sampling interval.
+        mask: 1.0 for the features that vary in the data, 0.0 for the constant ones (e.g. S_O),
+            whose scales are set to 1.0.
+        t_scale: The time span of the data.
+    """
+    neural = model.template[0] if hasattr(model, 'template') else getattr(model, 'neural', model)
+    y_scale, dy_scale = neural.ystd.reshape(-1), neural.ytscale.reshape(-1).to(neural.ystd.dtype)
+    active = (y_scale > 1e-12) & (dy_scale > 0)
+    ones = torch.ones_like(y_scale)
+    # ytscale = (ymax - ymin) / time span, see estimate_mean_std()
+    y_range = (neural.ymax - neural.ymin).reshape(-1)
+    t_scale = torch.mean((y_range / dy_scale)[active])
+    return torch.where(active, y_scale, ones), torch.where(active, dy_scale, ones), active.to(y_scale.dtype), t_scale
+
+def jacobian_frobenius(model, t, y, n_samples=1):
+    # Hutchinson estimate of the squared Frobenius norm of the standardised Jacobian,
+    # diag(1/dy_scale) df/dy diag(y_scale), as E[|e^T J|^2] with e ~ N(0, I)
+    y_scale, dy_scale, mask, _ = normalisation_scales(model)
+    y = y.detach().requires_grad_(True)
+    f = model(t, y)
+    penalty = 0.0
+    for _ in range(n_samples):
+        e = torch.randn_like(f) * mask / dy_scale
+        e_J = torch.autograd.grad(f, y, e, create_graph=True)[0] * y_scale * mask
+        penalty = penalty + torch.sum(e_J ** 2, dim=-1).reshape(-1) / n_samples
+    return penalty
+
+def kinetic_energy(model, t, y):
+    # squared norm of the standardised vector field, |f / dy_scale|^2
+    _, dy_scale, mask, _ = normalisation_scales(model)
+    f = model(t, y.detach())
+    return torch.sum((f * mask / dy_scale) ** 2, dim=-1).reshape(-1)
+
+def taylor(model, t, y):
+    # squared norm of the second time derivative of the solution, |d2y/dt2|^2 = |df/dy f|^2, standardised
+    # as the vector field and per time span, the Jacobian-vector product by the double-backward trick
+    _, dy_scale, mask, t_scale = normalisation_scales(model)
+    y = y.detach().requires_grad_(True)
+    f = model(t, y)
+    v = torch.zeros_like(f, requires_grad=True)
+    vJ = torch.autograd.grad(f, y, v, create_graph=True)[0]
+    Jf = torch.autograd.grad(vJ, v, f * mask, create_graph=True)[0]
+    return torch.sum((Jf * mask * t_scale / dy_scale) ** 2, dim=-1).reshape(-1)
+
+regularisers = {'jacobian': jacobian_frobenius, 'kinetic': kinetic_energy, 'taylor': taylor}
+
+# default weights, such that the penalty of the ASM1 dynamics themselves (jacobian ~ 1e4, kinetic ~ 1e2 and
+# taylor ~ 1e5 over the default trajectory), i.e. of a perfect fit, weighs about 1e-2, small next to the loss
+default_weights = {'jacobian': 1e-6, 'kinetic': 1e-4, 'taylor': 1e-7}
+
+
+def regularisation_penalty(regulariser, model, t, y, n_members=1, weight=None):
+    """
+    Returns the weighted mean penalty of every member, with dimension (n_members,).
+
+    Args:
+        regulariser: A name of regularisers ('jacobian', 'kinetic' or 'taylor'), or a function as those.
+        model: The model, for an ensembleODE the states hold the K member blocks one after the other.
+        t: The time, passed to the model.
+        y: The states at which the vector field is penalised, the last dimension holds the features.
+        n_members: Number of members of an ensembleODE.
+        weight: The weight of the penalty (default: None, default_weights of the regulariser, 1.0 for a function).
+    """
+    regulariser_fn = regularisers[regulariser] if isinstance(regulariser, str) else regulariser
+    if weight is None:
+        weight = default_weights[regulariser] if isinstance(regulariser, str) else 1.0
+    nf = y.size(dim=y.ndim-1)
+    penalty = regulariser_fn(model, t, y.reshape(-1, 1, nf))
+    return weight * torch.mean(penalty.reshape(n_members, -1), dim=1)
+
+
+def solver_cost(model, t, y0, solver='dopri5', repeats=3):
+    """
+    Measures what it costs to integrate a model, e.g. before and after training with a regulariser.
+
+    Args:
+        model: The model, e.g. a neuralODE, an ensembleODE (each member from every initial state) or a hybridODE.
+        t: A torch list of ascending time points.
+        y0: A torch tensor of initial states with dimension (S, number_of_features).
+        solver: The solver name, see ode_solver().
+        repeats: Number of solves, the fastest wall time is reported.
+
+    Returns:
+        A dict with the function evaluations, the accepted and rejected steps, and the wall time in seconds.
+    """
+    noFeature = y0.size(dim=y0.ndim-1)
+    n_members = getattr(model, 'n_members', 1)
+    ode_func = instrumentedODE(model)
+    model.eval()
+    wall_time = []
+    with torch.no_grad():
+        for _ in range(repeats):
+            ode_func.reset()
+            start = time.perf_counter()
+            ode_solver(ode_func, y0.reshape(-1, 1, noFeature).repeat(n_members, 1, 1), t, method=solver)
+            wall_time.append(time.perf_counter() - start)
+    stats = ode_func.statistics()
+    return {'nfe': stats['nfe_forward'], 'n_accepted': stats['n_accepted'], 'n_rejected': stats['n_rejected'], 'time': min(wall_time)}
+
+
+def regularisation_effect(training_fn, model, t, y0, regulariser, reg_weight=None, solver='dopri5', seed=0, sampler_fn=None):
+    """
+    Trains copies of model without and with a regulariser on the same batches, and reports what it
+    costs to integrate each of them afterwards, see solver_cost(), with the changes by the regulariser.
+
+    Args:
+        training_fn: A function training_fn(model, regulariser=..., reg_weight=...) returning the model and
+            loss_list first, e.g. functools.partial(NODE_training, t, true_y, n_iters=500)
+            or functools.partial(collocation_training, t, coll_y, coll_dy).
+        model: The model to train, e.g. a neuralODE, an ensembleODE or a hybridODE.
+        t, y0, solver: The solves of solver_cost(), e.g. t and true_y[0].
+        regulariser, reg_weight: See regularisation_penalty().
+        seed: The seed of the global random generators before each training.
+        sampler_fn: A function sampler_fn(seed) returning the batch sampler of a training, passed to training_fn
+            as sampler=..., e.g. lambda seed: windowSampler(t, true_y, seed=seed) for NODE_training. The seeded
+            sampler draws the same batches in both trainings, whereas the global torch generator is also advanced
+            by the random probes of the 'jacobian' regulariser (default: None, the batches of training_fn;
+            collocation_training draws them from np.random, which the regularisers leave alone).
+
+    Returns:
+        A dict per mode ('unregularised', 'regularised') with the final loss (without the penalty), the function
+        evaluations, the accepted and rejected steps and the wall time, and the relative change of the loss,
+        the function evaluations and the wall time ('change').
+    """
+    results = {}
+    for mode, options in (('unregularised', {}), ('regularised', {'regulariser': regulariser, 'reg_weight': reg_weight})):
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        if sampler_fn is not None:
+            options['sampler'] = sampler_fn(seed)
+        trained, loss_list, *_ = training_fn(copy.deepcopy(model), **options)
+        # the mean loss of the last iterations, less noisy than the last minibatch
+        results[mode] = {'loss': float(np.mean(np.sum(np.reshape(loss_list[-10:], (min(len(loss_list), 10), -1)), axis=1)))}
+        results[mode].update(solver_cost(trained, t, y0, solver))
+    results['change'] = {key: results['regularised'][key] / results['unregularised'][key] - 1 for key in ('loss', 'nfe', 'time')}
+
+    for mode in ('unregularised', 'regularised'):
+        result = results[mode]
+        print('{}: loss {:.4g}, NFE {}, steps {} accepted / {} rejected, {:.3f} s'.format(mode, result['loss'], result['nfe'],
+              result['n_accepted'], result['n_rejected'], result['time']))
+    print('{}: loss {:+.1%}, NFE {:+.1%}, wall time {:+.1%}'.format(regulariser, results['change']['loss'], results['change']['nfe'], results['change']['time']))
+    return results
@@ -0,0 +1,48 @@
+### Simulation of many scenarios at once ###
+import torch
+from ode_solver import ode_solver
+from mechanistic_model import mechanisticODE
+
+def simulation(model, t, y0, ref_y=None, solver='dopri5', chunk_size=None, rtol=1e-7, atol=1e-9):
+    """
+    Predicts the trajectories of a batch of initial states in one solve, e.g. for what-if scenarios.
+
+    Args:
+        model: The right-hand side, a trained neuralODE (or an exported one, see export_model()) or a
+            mechanisticODE; a mechanisticODE with one kinetic set per scenario (S, 16) is split along
+            with the scenarios. For an ensembleODE simulate its members, model.member(k).
+        t: A torch list of ascending time points.
+        y0: A torch tensor of initial states with dimension (S, number_of_features).
+        ref_y: Reference trajectories with dimension (length(t), S, number_of_features) (default: None).
+        solver: The solver name, see ode_solver().
+        chunk_size: Number of scenarios per solve (default: None, all in one). Bounds the memory, and
+            keeps an adaptive solver from taking the smallest step of all S scenarios for every one.
+        rtol, atol: Relative and absolute tolerances.
+
+    Returns:
+        pred_y: The predictions with dimension (length(t), S, number_of_features).
+        RMSE: With ref_y, also the RMSE of every scenario over all time points and features, dimension (S,).
+    """
+    if hasattr(model, 'n_members'):
+        raise ValueError("Simulate the members of an ensemble one by one, model.member(k)!")
+
+    noFeature = y0.size(dim=y0.ndim-1)
+    y0 = y0.reshape(-1, 1, noFeature)
+    noScenario = y0.size(dim=0)
+    if chunk_size is None:
+        chunk_size = noScenario
+    per_scenario = isinstance(model, mechanisticODE) and model.kinetic.ndim > 1
+
+    model.eval()
+    pred_y = []
+    with torch.no_grad():
+        for start in range(0, noScenario, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            func = mechanisticODE(model.nf, model.kinetic[chunk], model.stoiP) if per_scenario else model
+            pred_y.append(ode_solver(func, y0[chunk], t, method=solver, rtol=rtol, atol=atol).view(len(t), -1, noFeature))
+    pred_y = torch.cat(pred_y, dim=1)
+
+    if ref_y is not None:
+        RMSE = torch.sqrt(torch.mean((pred_y - ref_y.view(len(t), noScenario, noFeature)) ** 2, dim=(0, 2)))
+        return pred_y, RMSE
+    return pred_y
@@ -0,0 +1,113 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from ode_solver import batched_jacobian
+
+# fixed bin edges (in days) of the step-size histograms, so that iterations can be compared
+dt_bins = 10.0 ** np.arange(-10, 0.5, 0.5)
+
+### Wrapper counting the work an ODE solver spends on a right-hand side ###
+
+class instrumentedODE(nn.Module):
+
+    def __init__(self, func):
+        super(instrumentedODE, self).__init__()
+        self.func = func
+        self.n_members = getattr(func, 'n_members', 1)
+        self.reset()
+
+    def reset(self):
+        self.nfe_forward = 0
+        self.nfe_backward = 0
+        self.n_accepted = 0
+        self.n_rejected = 0
+        self.dt = []
+
+    def forward(self, t, y):
+        self.nfe_forward += 1
+        dy = self.func(t, y)
+        if dy.requires_grad:
+            dy.register_hook(self.count_backward)
+        return dy
+
+    def count_backward(self, grad):
+        self.nfe_backward += 1
+
+    # step callbacks, called by the adaptive torchdiffeq solvers and by rosenbrock23
+    def callback_accept_step(self, t0, y0, dt):
+        self.n_accepted += 1
+        self.dt.append(float(dt.detach()))
+
+    def callback_reject_step(self, t0, y0, dt):
+        self.n_rejected += 1
+
+    def statistics(self):
+        """
+        Returns:
+            A dict with the forward and backward function evaluations, the accepted and rejected steps,
+            the smallest and largest accepted step and the histogram of the accepted steps over dt_bins.
+        """
+        dt = np.array(self.dt)
+        return {'nfe_forward': self.nfe_forward,
+                'nfe_backward': self.nfe_backward,
+                'n_accepted': self.n_accepted,
+                'n_rejected': self.n_rejected,
+                'min_dt': dt.min() if dt.size else np.nan,
+                'max_dt': dt.max() if dt.size else np.nan,
+                'dt_histogram': np.histogram(dt, bins=dt_bins)[0]}
+
+
+def stiffness_ratio(func, t, y):
+    """
+    Estimates the stiffness along a trajectory from the eigenvalues of the Jacobian df/dy.
+
+    Args:
+        func: The right-hand side func(t, y).
+        t: The time point(s), passed to func unchanged.
+        y: A torch tensor of states along the trajectory, the last dimension holds the features.
+
+    Returns:
+        ratio: Stiffness ratio max|Re(lambda)| / min|Re(lambda)| over the decaying modes, per state.
+        max_eigenvalue: The largest |Re(lambda)|, which limits the step of explicit solvers, per state.
+    """
+    J = batched_jacobian(func, t, y.detach())
+    re = torch.linalg.eigvals(J.double()).real.abs()
+
+    # ignore the (numerically) zero eigenvalues of inert states
+    max_eigenvalue = re.max(dim=-1).values
+    active = re > 1e-8 * max_eigenvalue.unsqueeze(-1)
+    min_eigenvalue = torch.where(active, re, torch.full_like(re, np.inf)).min(dim=-1).values
+
+    return max_eigenvalue / min_eigenvalue, max_eigenvalue
+
+
+class forwardSavedMemory:
+
+    def __init__(self):
+        """
+        Context manager measuring the tensors autograd saves for backpropagation during the forward
+        pass inside the context, each storage counted once. This is not the peak memory: with
+        gradient='checkpoint' the graph of a segment is rebuilt during the backward pass, and with
+        gradient='adjoint' the solver keeps its states outside autograd, neither of which is counted.
+        """
+        self.storages = {}
+
+    def pack(self, x):
+        storage = x.untyped_storage()
+        self.storages[storage.data_ptr()] = storage.nbytes()
+        return x
+
+    def unpack(self, x):
+        return x
+
+    def __enter__(self):
+        self.hooks = torch.autograd.graph.saved_tensors_hooks(self.pack, self.unpack)
+        self.hooks.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.hooks.__exit__(*args)
+
+    @property
+    def nbytes(self):
+        return sum(self.storages.values())
@@ -0,0 +1,93 @@
+import numpy as np
+import torch
+from collocate_data_torch import local_polynomial_fit
+from kernels import kernel_radius
+
+### Collocation of a measurement stream, chunk by chunk ###
+
+class streamingCollocation:
+
+    def __init__(self, h, kernel_str="EpanechnikovKernel", kernel_tol=None):
+        """
+        Smooths a stream of measurements with the local polynomial estimates of collocate_data_torch().
+
+        A point is fitted once the measurements up to latency = radius * h after it have arrived, so
+        `y` and `dy` are emitted with a fixed latency in time. Only the measurements inside the windows
+        of the points still to be fitted are kept, so memory and cost per point do not grow with the
+        length of the stream. Apart from the end of the stream, see flush(), the result equals that of
+        collocate_data_torch() on the whole series with the same bandwidth.
+
+        Args:
+            h: The bandwidth, in the units of t, e.g. from select_bandwidth() on past data.
+            kernel_str: The kernel function to use (default: "EpanechnikovKernel"), it must have compact support.
+            kernel_tol: Truncates a kernel without compact support, see kernel_radius() (default: None).
+        """
+        radius = kernel_radius(kernel_str, kernel_tol)
+        if radius is None:
+            raise ValueError("Streaming collocation needs a kernel with compact support, or kernel_tol!")
+        self.h = h
+        self.kernel_str = kernel_str
+        self.kernel_tol = kernel_tol
+        self.latency = radius * h
+
+        # buffer of the measurements still needed, and the index of the first point not emitted yet
+        self.t = np.zeros(0)
+        self.y = None
+        self.shape = None
+        self.dtype = None
+        self.next = 0
+
+    def update(self, t, y):
+        """
+        Adds a chunk of measurements and emits the points whose window is complete.
+
+        Args:
+            t: A torch list of ascending time points, later than those of earlier chunks.
+            y: A torch tensor with dimension (length(t), 1, number_of_features),
+                or (length(t), number_of_scenarios, number_of_features).
+
+        Returns:
+            t, y, dy: The emitted time points, smoothed data and smoothed derivative, possibly empty.
+        """
+        tpoints = t.detach().reshape(-1).numpy().astype(np.float64)
+        if self.shape is None:
+            self.shape, self.dtype = y.shape[1:], t.dtype
+            self.y = np.zeros((0, int(np.prod(self.shape))), dtype=y.detach().numpy().dtype)
+        if len(self.t) > 0 and tpoints[0] <= self.t[-1]:
+            raise ValueError("The time points of the stream must keep ascending!")
+
+        self.t = np.concatenate((self.t, tpoints))
+        self.y = np.concatenate((self.y, y.detach().reshape(len(tpoints), -1).numpy()))
+
+        if len(self.t) == 0:
+            return self.emit(0)
+        # points whose window [t_i - latency, t_i + latency] has arrived
+        return self.emit(np.searchsorted(self.t, self.t[-1] - self.latency, side='right'))
+
+    def flush(self):
+        """
+        Emits the remaining points, with the one-sided windows of the end of the series.
+        """
+        return self.emit(len(self.t))
+
+    def emit(self, ready):
+        if self.shape is None:
+            raise ValueError("No measurements to collocate yet!")
+
+        points = np.arange(self.next, ready)
+        if len(points) == 0:
+            y = dy = np.zeros((0, self.y.shape[1]), dtype=self.y.dtype)
+        else:
+            y, dy = local_polynomial_fit(self.t, self.y, self.h, self.kernel_str, kernel_tol=self.kernel_tol, points=points)
+        emitted = (torch.from_numpy(self.t[points]).to(self.dtype),
+                   torch.from_numpy(y).view(len(points), *self.shape), torch.from_numpy(dy).view(len(points), *self.shape))
+        if len(self.t) == 0:
+            return emitted
+        self.next = ready
+
+        # drop the measurements outside the windows of the points still to come
+        first = self.t[min(self.next, len(self.t) - 1)] - self.latency
+        keep = np.searchsorted(self.t, first, side='left')
+        self.t, self.y, self.next = self.t[keep:], self.y[keep:], self.next - keep
+
+        return emitted
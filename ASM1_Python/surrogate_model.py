@@ -0,0 +1,129 @@
+import warnings
+import torch
+import torch.nn as nn
+from ode_solver import ode_solver
+from export_model import export_model
+
+### Fixed-step surrogate of a trained NODE, one TorchScript module for real-time use ###
+
+class surrogateODE(nn.Module):
+
+    def __init__(self, func, method='rk4', substeps=1):
+        """
+        Integrates an exported model (see export_model()) with a fixed number of steps per output interval,
+        so every call costs the same and needs no solver package.
+
+        Args:
+            func: The exported model, called as func(t, y), e.g. export_model(model, compile=None).
+            method: 'euler', 'rk4' (default), or 'implicit_euler' for stiff dynamics: linearly implicit
+                Euler with the Jacobian from finite differences, all states perturbed in one batch.
+            substeps: Number of steps per output interval.
+        """
+        super(surrogateODE, self).__init__()
+        if method not in ('euler', 'rk4', 'implicit_euler'):
+            raise ValueError("Wrong surrogate integration method!")
+        self.func = func
+        self.method = method
+        self.substeps = substeps
+        # relative perturbation of the finite differences, the square root of the float32 machine epsilon
+        self.fd_eps = 3.5e-4
+        self.register_buffer('t0', torch.zeros(1))
+
+    def rhs(self, y):
+        return self.func(self.t0, y)
+
+    def jacobian(self, y, f0):
+        # J[b, i, j] = df_i/dy_j, with the n perturbed copies of every state evaluated as one batch
+        n = y.size(1)
+        eps = self.fd_eps * torch.clamp(y.abs(), min=1.0)
+        f = self.rhs((y.unsqueeze(1) + torch.diag_embed(eps)).reshape(-1, n)).reshape(-1, n, n)
+        return ((f - f0.unsqueeze(1)) / eps.unsqueeze(-1)).transpose(1, 2)
+
+    def step(self, y, dt: float):
+        if self.method == 'euler':
+            return y + dt * self.rhs(y)
+        if self.method == 'rk4':
+            k1 = self.rhs(y)
+            k2 = self.rhs(y + 0.5 * dt * k1)
+            k3 = self.rhs(y + 0.5 * dt * k2)
+            k4 = self.rhs(y + dt * k3)
+            return y + dt / 6.0 * (k1 + 2.0 * k2 + 2.0 * k3 + k4)
+        # linearly implicit Euler, (I - dt J) k = f
+        f0 = self.rhs(y)
+        A = torch.eye(y.size(1), dtype=y.dtype, device=y.device) - dt * self.jacobian(y, f0)
+        return y + dt * torch.linalg.solve(A, f0.unsqueeze(-1)).squeeze(-1)
+
+    def forward(self, y0, t):
+        """
+        Args:
+            y0: A torch tensor of initial states with dimension (S, number_of_features).
+            t: A torch list of ascending time points.
+
+        Returns:
+            The predictions with dimension (length(t), S, number_of_features).
+        """
+        y = y0
+        pred_y = [y0]
+        for i in range(t.size(0) - 1):
+            dt = float((t[i + 1] - t[i]).item()) / self.substeps
+            for _ in range(self.substeps):
+                y = self.step(y, dt)
+            pred_y.append(y)
+        return torch.stack(pred_y)
+
+
+def export_surrogate(model, method='rk4', substeps=1, t=None, y0=None, rtol=None, atol=1e-3, max_substeps=256, path=None):
+    """
+    Exports a trained neuralODE as a frozen TorchScript surrogateODE: the net with its normalisation
+    folded in (see export_model()) and a fixed-step integrator, called as surrogate(y0, t).
+
+    With t, y0 and rtol, substeps is doubled from its given value until the surrogate stays within
+    atol + rtol * |y| of the adaptive dopri5 solution y of model along t, so the error bound is settled
+    at export and the latency stays fixed in use. Doubling stops as well once it no longer reduces the
+    error, e.g. at the rounding noise of a single precision model, keeping the cheaper surrogate; a
+    warning is given if the bound is not reached.
+
+    Args:
+        model: A neuralODE.
+        method: 'euler', 'rk4' or 'implicit_euler', see surrogateODE.
+        substeps: Number of steps per output interval, or the first one tried with rtol.
+        t, y0: Time points and initial states (S, number_of_features) of the reference solution.
+        rtol: The relative bound on the error of the surrogate (default: None, substeps is used as given).
+        atol: The absolute bound on the error, in the units of the states, for states close to zero.
+        max_substeps: The largest number of steps per output interval tried.
+        path: Saves the surrogate to this file, loaded by torch.jit.load(path) without this package (default: None).
+
+    Returns:
+        surrogate: The surrogate.
+        error: The largest error relative to atol + rtol * |y|, at most 1 if the bound is met (None without rtol).
+    """
+    func = export_model(model, compile=None)
+
+    def build(n):
+        return torch.jit.freeze(torch.jit.script(surrogateODE(func, method, n).eval()))
+
+    surrogate = build(substeps)
+    error = None
+    if rtol is not None:
+        noFeature = y0.size(dim=y0.ndim-1)
+        y0 = y0.reshape(-1, noFeature)
+        model.eval()
+        with torch.no_grad():
+            ref_y = ode_solver(model, y0.view(-1, 1, noFeature), t).view(len(t), -1, noFeature)
+            # mixed tolerance, so features that barely change (e.g. X_I) are not held to their own jitter
+            scale = atol + rtol * ref_y.abs()
+            error = torch.max(torch.abs(surrogate(y0, t) - ref_y) / scale).item()
+            while error > 1.0 and substeps < max_substeps:
+                trial = build(substeps * 2)
+                trial_error = torch.max(torch.abs(trial(y0, t) - ref_y) / scale).item()
+                if trial_error > 0.9 * error:
+                    break
+                surrogate, substeps, error = trial, substeps * 2, trial_error
+        print('Surrogate with {} {} steps per interval, error {:.2e} of the tolerance'.format(substeps, method, error))
+        if error > 1.0:
+            warnings.warn('The surrogate misses the tolerance by a factor {:.2e} with {} {} steps per interval '
+                          '(max_substeps={}).'.format(error, substeps, method, max_substeps))
+
+    if path is not None:
+        surrogate.save(path)
+    return surrogate, error
@@ -0,0 +1,45 @@
+import numpy as np
+import torch
+import pytest
+from IVP_data_generation import IVP_data_generation
+from estimate_mean_std import estimate_mean_std
+from model_initiation import model_initiation
+from collocation_training import full_batch_collocation_training
+
+### Fits the derivatives of a short generated trajectory with full-batch L-BFGS ###
+
+@pytest.fixture(scope='module')
+def data():
+    t, true_y, true_dy = IVP_data_generation(data_size=50)
+    return t, true_y, true_dy
+
+
+def test_full_batch_collocation_training(data):
+    t, true_y, true_dy = data
+    torch.manual_seed(0)
+    model = model_initiation(*estimate_mean_std(t, true_y), width=16)
+    model, loss_list, grad_norm, lr_list, elapsed = full_batch_collocation_training(t, true_y, true_dy, model, n_iters=5, max_iter=10)
+
+    assert len(loss_list) == len(grad_norm) == len(lr_list) == len(elapsed) == 5
+    assert np.all(np.isfinite(loss_list))
+    # the full-batch MAE decreases with the L-BFGS steps
+    assert loss_list[-1] < loss_list[0]
+    assert np.all(np.diff(elapsed) >= 0)
+
+
+def test_full_batch_collocation_target(data):
+    t, true_y, true_dy = data
+    torch.manual_seed(0)
+    model = model_initiation(*estimate_mean_std(t, true_y), width=16)
+    _, loss_list, _, _, _ = full_batch_collocation_training(t, true_y, true_dy, model, n_iters=5, max_iter=10)
+
+    # stops at the first step reaching a loss of the run above, and refines on minibatches afterwards
+    target = min(loss_list[:3])
+    n_steps = int(np.argmax(np.array(loss_list) <= target)) + 1
+    torch.manual_seed(0)
+    np.random.seed(0)
+    model = model_initiation(*estimate_mean_std(t, true_y), width=16)
+    _, target_loss, _, _, elapsed = full_batch_collocation_training(t, true_y, true_dy, model, n_iters=5, max_iter=10,
+        target_loss=target, refine_iters=3)
+    assert len(elapsed) == n_steps
+    assert len(target_loss) == n_steps + 3
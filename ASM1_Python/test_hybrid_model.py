@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+import pytest
+from IVP_data_generation import IVP_data_generation
+from estimate_mean_std import estimate_mean_std
+from model_initiation import model_initiation
+from collocation_training import collocation_training
+from default_stoichiometric_kinetic_value import default_stoichimetric_kinetic_value
+
+### Trains the hybrid model on the derivatives of a short generated trajectory ###
+
+@pytest.fixture(scope='module')
+def data():
+    t, true_y, true_dy = IVP_data_generation(data_size=50)
+    return t, true_y, true_dy
+
+
+def test_hybrid_starts_from_mechanistic(data):
+    t, true_y, true_dy = data
+    _, kineP, _ = default_stoichimetric_kinetic_value()
+    model = model_initiation(*estimate_mean_std(t, true_y), width=16, hybrid=True)
+
+    assert torch.allclose(model.kinetic(), kineP)
+    with torch.no_grad():
+        assert torch.allclose(model(t, true_y), true_dy, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('freeze_mechanistic, freeze_neural', [(True, False), (False, True)])
+def test_hybrid_freeze(data, freeze_mechanistic, freeze_neural):
+    t, true_y, true_dy = data
+    model = model_initiation(*estimate_mean_std(t, true_y), width=16, hybrid=True,
+                             freeze_mechanistic=freeze_mechanistic, freeze_neural=freeze_neural)
+    neural = [p.detach().clone() for p in model.neural.parameters()]
+
+    # derivatives 10 % off the mechanistic ones, so both parts have something to correct
+    torch.manual_seed(0)
+    np.random.seed(0)
+    model, loss_list, grad_norm, _ = collocation_training(t, true_y, 1.1 * true_dy, model, n_iters=10, batch_size=16, ilr=1e-2)
+
+    assert np.all(np.isfinite(loss_list)) and np.all(np.isfinite(grad_norm))
+    kinetic_moved = not torch.equal(model.log_kinetic, torch.zeros_like(model.log_kinetic))
+    neural_moved = any(not torch.equal(p, q) for p, q in zip(model.neural.parameters(), neural))
+    assert kinetic_moved != freeze_mechanistic
+    assert neural_moved != freeze_neural
+    # the stoichiometry stays fixed
+    assert not model.mechanistic.stoiP.requires_grad
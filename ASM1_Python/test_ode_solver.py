@@ -0,0 +1,37 @@
+import torch
+import pytest
+from ode_solver import ode_solver
+from IVP_data_generation import IVP_data_generation
+from estimate_mean_std import estimate_mean_std
+from model_initiation import model_initiation
+
+### Compares the gradient modes of ode_solver on a short generated trajectory ###
+
+@pytest.fixture(scope='module')
+def data():
+    t, true_y, _ = IVP_data_generation(data_size=50)
+    return t.double(), true_y.double()
+
+
+def gradients(model, t, true_y, **kwargs):
+    model.zero_grad()
+    y0 = true_y[0].reshape(-1, 1, true_y.size(dim=-1))
+    pred_y = ode_solver(model, y0, t, **kwargs)
+    torch.mean(torch.abs(pred_y - true_y.reshape(pred_y.shape))).backward()
+    return torch.cat([p.grad.reshape(-1) for p in model.parameters()])
+
+
+def test_stiff_adjoint_gradients(data):
+    t, true_y = data
+    torch.manual_seed(0)
+    # 'zscore' with constant features (e.g. S_O), whose inverse standard deviation is 1e12
+    model = model_initiation(*estimate_mean_std(t, true_y)).double()
+    # four windows of four time points
+    t_window = t[:4]
+    windows = torch.stack([true_y[k:k + 4, 0] for k in (0, 10, 20, 30)], dim=1)
+
+    direct = gradients(model, t_window, windows, method='dopri5', rtol=1e-10, atol=1e-12)
+    adjoint = gradients(model, t_window, windows, method='rosenbrock23', rtol=1e-7, atol=1e-9, gradient='adjoint')
+
+    assert torch.all(torch.isfinite(adjoint))
+    assert torch.linalg.norm(adjoint - direct) < 1e-3 * torch.linalg.norm(direct)
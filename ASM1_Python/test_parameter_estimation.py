@@ -0,0 +1,69 @@
+import torch
+import pytest
+import parameter_estimation
+from parameter_estimation import kinetic_calibration, monte_carlo_simulation
+from IVP_data_generation import IVP_data_generation
+from default_stoichiometric_kinetic_value import default_stoichimetric_kinetic_value
+
+### Runs the calibration and the Monte Carlo simulation on a short generated trajectory ###
+
+@pytest.fixture(scope='module')
+def data():
+    _, kineP, _ = default_stoichimetric_kinetic_value()
+    t, true_y, _ = IVP_data_generation(data_size=50)
+    return t, true_y, kineP
+
+
+def test_kinetic_calibration(data):
+    t, true_y, kineP = data
+    # u_A and u_H from a guess 20 % off
+    guess = kineP.double().clone()
+    guess[[0, 5]] *= 1.2
+    start = guess.clone()
+    fitted, loss_list, cov = kinetic_calibration(t, true_y, kineP=guess, fit=[0, 5], n_iters=10)
+
+    assert torch.equal(guess, start)
+    assert fitted.dtype == torch.float64 and fitted.shape == (16,)
+    assert loss_list[-1] < 0.5 * loss_list[0]
+    assert torch.all(torch.abs(fitted[[0, 5]] / kineP[[0, 5]] - 1) < 0.05)
+    # parameters not fitted keep the guess and have no variance
+    assert torch.equal(fitted[1], guess[1])
+    assert cov.shape == (16, 16) and cov[1, 1] == 0 and cov[0, 0] > 0
+
+
+def test_kinetic_calibration_solver_failure(data, monkeypatch):
+    t, true_y, kineP = data
+    guess = kineP.double().clone()
+    guess[0] *= 1.2
+
+    # the first trial solve fails as on stiff trial parameters, the step is rejected and the damping increased
+    solver = parameter_estimation.ode_solver
+    calls = {'trials': 0}
+
+    def failing_solver(func, y0, t, **kwargs):
+        if y0.size(dim=-1) == true_y.size(dim=-1):
+            calls['trials'] += 1
+            if calls['trials'] == 1:
+                raise AssertionError('underflow in dt 0.0')
+        return solver(func, y0, t, **kwargs)
+
+    monkeypatch.setattr(parameter_estimation, 'ode_solver', failing_solver)
+    fitted, loss_list, _ = kinetic_calibration(t, true_y, kineP=guess, fit=[0], n_iters=5)
+
+    assert calls['trials'] > 1
+    assert loss_list[-1] < loss_list[0]
+
+
+def test_monte_carlo_simulation(data):
+    t, true_y, kineP = data
+    bands, samples = monte_carlo_simulation(t, true_y[0], n_samples=16, kineP=kineP, cv=0.05, seed=0)
+
+    assert bands.shape == (3, len(t), true_y.size(dim=-1))
+    assert samples.shape == (16, 16)
+    assert torch.all(bands[0] <= bands[1]) and torch.all(bands[1] <= bands[2])
+    # every band starts at the initial state
+    assert torch.allclose(bands[:, 0], true_y[0].double().expand(3, -1))
+
+    # the same seed gives the same samples
+    _, samples_again = monte_carlo_simulation(t, true_y[0], n_samples=16, kineP=kineP, cv=0.05, seed=0)
+    assert torch.equal(samples, samples_again)
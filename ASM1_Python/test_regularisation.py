@@ -0,0 +1,50 @@
+import torch
+import pytest
+from IVP_data_generation import IVP_data_generation
+from estimate_mean_std import estimate_mean_std
+from model_initiation import model_initiation
+from regularisation import regularisation_penalty, regularisers, solver_cost
+
+### Evaluates the regularisers of the learned vector field on a short generated trajectory ###
+
+@pytest.fixture(scope='module')
+def data():
+    t, true_y, _ = IVP_data_generation(data_size=50)
+    return t, true_y
+
+
+@pytest.mark.parametrize('regulariser', sorted(regularisers))
+@pytest.mark.parametrize('n_members', [1, 2])
+def test_regularisation_penalty(data, regulariser, n_members):
+    t, true_y = data
+    torch.manual_seed(0)
+    model = model_initiation(*estimate_mean_std(t, true_y), n_members=n_members, width=16)
+    y = true_y.repeat(n_members, 1, 1)
+
+    penalty = regularisation_penalty(regulariser, model, t[0], y, n_members)
+    assert penalty.shape == (n_members,)
+    assert torch.all(torch.isfinite(penalty)) and torch.all(penalty > 0)
+
+    # finite gradients, also with 'zscore' features that are constant in the data (e.g. S_O)
+    torch.sum(penalty).backward()
+    grads = [p.grad for p in model.parameters() if p.grad is not None]
+    assert len(grads) > 0
+    assert all(torch.all(torch.isfinite(g)) for g in grads)
+
+
+def test_regularisation_weight(data):
+    t, true_y = data
+    torch.manual_seed(0)
+    model = model_initiation(*estimate_mean_std(t, true_y), width=16)
+
+    penalty = regularisation_penalty('kinetic', model, t[0], true_y, weight=1.0)
+    assert torch.allclose(regularisation_penalty('kinetic', model, t[0], true_y, weight=2.0), 2 * penalty)
+
+
+def test_solver_cost(data):
+    t, true_y = data
+    torch.manual_seed(0)
+    model = model_initiation(*estimate_mean_std(t, true_y), width=16)
+
+    cost = solver_cost(model, t[:10], true_y[0], repeats=1)
+    assert cost['nfe'] > 0 and cost['n_accepted'] > 0 and cost['time'] > 0
@@ -0,0 +1,42 @@
+import torch
+import pytest
+from IVP_data_generation import IVP_data_generation
+from estimate_mean_std import estimate_mean_std
+from model_initiation import model_initiation
+from ode_solver import ode_solver
+from surrogate_model import surrogateODE, export_surrogate
+
+### Exports a fixed-step surrogate of a NODE and compares it with the adaptive solve ###
+
+@pytest.fixture(scope='module')
+def data():
+    t, true_y, _ = IVP_data_generation(data_size=50)
+    torch.manual_seed(0)
+    model = model_initiation(*estimate_mean_std(t, true_y), width=16)
+    return t, true_y, model
+
+
+@pytest.mark.parametrize('method', ['rk4', 'implicit_euler'])
+def test_export_surrogate(data, method, tmp_path):
+    t, true_y, model = data
+    nf = true_y.size(dim=-1)
+    y0 = true_y[0].reshape(-1, nf)
+    path = str(tmp_path / 'surrogate.pt')
+    rtol, atol = 1e-3, 1e-3
+
+    surrogate, error = export_surrogate(model, method=method, t=t, y0=y0, rtol=rtol, atol=atol, path=path)
+    # the first-order implicit Euler may stop short of the tolerance, and reports by how much
+    if method == 'rk4':
+        assert error <= 1.0
+
+    # the saved surrogate stays within the reported error of dopri5 on its own
+    with torch.no_grad():
+        ref_y = ode_solver(model, y0.view(-1, 1, nf), t).view(len(t), -1, nf)
+        pred_y = torch.jit.load(path)(y0, t)
+    assert pred_y.shape == ref_y.shape
+    assert torch.all(torch.abs(pred_y - ref_y) <= max(error, 1.0) * (atol + rtol * ref_y.abs()) * (1 + 1e-5))
+
+
+def test_surrogate_method():
+    with pytest.raises(ValueError):
+        surrogateODE(lambda t, y: y, method='dopri5')
@@ -0,0 +1,68 @@
+import math
+import torch
+import torch.nn as nn
+import pytest
+from training_engine import training_engine, loss_functions, schedulers
+
+### Runs the losses, the schedules and the training loop on a small regression ###
+
+@pytest.mark.parametrize('name', sorted(loss_functions))
+def test_losses(name):
+    pred = torch.tensor([[[1.0, 2.0], [3.0, 4.0]], [[1.0, 2.0], [3.0, 4.0]]])
+    target = pred.clone()
+    target[1] += 0.5
+
+    loss = loss_functions[name](pred, target)
+    # one loss per member, zero for a perfect prediction
+    assert loss.shape == (2,)
+    assert loss[0] == 0 and loss[1] > 0
+
+
+def test_logcosh_large_residuals():
+    pred = torch.tensor([[[0.0, 1e3]]])
+    loss = loss_functions['logcosh'](pred, torch.zeros_like(pred))
+    assert torch.isfinite(loss).all()
+    assert torch.allclose(loss, torch.tensor([(1e3 - math.log(2)) / 2]))
+
+
+@pytest.mark.parametrize('name', sorted(schedulers))
+def test_schedules(name):
+    lr = schedulers[name](0.1, 100)
+    values = [lr(it) for it in range(1, 101)]
+    assert values[0] == pytest.approx(0.1)
+    # none of them increases the learning rate
+    assert all(b <= a + 1e-12 for a, b in zip(values[:-1], values[1:]))
+
+
+def test_step_schedule():
+    lr = schedulers['step'](0.1, 100)
+    assert lr(20) == 0.1 and lr(21) == 0.05 and lr(100) == pytest.approx(0.1 * 0.5 ** 7)
+
+
+def regression():
+    torch.manual_seed(0)
+    x = torch.randn(64, 1, 3)
+    y = x @ torch.tensor([[1.0], [-2.0], [0.5]])
+    model = nn.Linear(3, 1)
+
+    def forward(batch):
+        return model(batch[0]).reshape(1, -1, 1), batch[1].reshape(1, -1, 1)
+    return model, (x, y), forward
+
+
+def test_training_engine():
+    model, batch, forward = regression()
+    model, loss_list, grad_norm, lr_list, telemetry = training_engine(model, lambda: batch, forward, 200, ilr=1e-1,
+        loss='mse', scheduler='cosine')
+
+    assert len(loss_list) == len(grad_norm) == len(lr_list) == 200
+    assert loss_list[-1] < 1e-2 * loss_list[0]
+    assert lr_list[0] == pytest.approx(0.1) and lr_list[-1] == pytest.approx(1e-4)
+
+
+def test_training_engine_early_stopping():
+    model, batch, forward = regression()
+    # a function as loss, and a validation that is met at once
+    model, loss_list, _, _, _ = training_engine(model, lambda: batch, forward, 200, loss=lambda pred, target: torch.mean((pred - target) ** 2, dim=(1, 2)),
+        validation_fn=lambda m: torch.zeros(1), target_rmse=1.0, validate_every=10)
+    assert len(loss_list) == 10
@@ -0,0 +1,36 @@
+import torch
+import torch.nn as nn
+from training_telemetry import trainingTelemetry, load_telemetry, gradient_norm, phases
+
+### Records a few iterations and reads the log back ###
+
+def test_telemetry_records_and_logs(tmp_path):
+    path = str(tmp_path / 'log.pt')
+    telemetry = trainingTelemetry(10, n_members=2, log_path=path, flush_every=2)
+    for it in range(4):
+        with telemetry.phase('forward'):
+            pass
+        telemetry.record(torch.tensor([1.0, 2.0]) * it, torch.tensor([0.5, 0.5]), 0.1,
+                         stats={'nfe_forward': it}, penalty=torch.tensor([0.25, 0.5]))
+    loss_list, grad_norm, lr_list = telemetry.close()
+
+    # one list per iteration for an ensemble, and only the iterations recorded
+    assert loss_list == [[0.0, 0.0], [1.0, 2.0], [2.0, 4.0], [3.0, 6.0]]
+    assert grad_norm == [[0.5, 0.5]] * 4
+    assert lr_list == [0.1] * 4
+    assert telemetry.penalties() == [[0.25, 0.5]] * 4
+    assert set(telemetry.summary()) == set(phases)
+
+    logged_loss, logged_grad, logged_lr, log = load_telemetry(path)
+    assert logged_loss == loss_list and logged_grad == grad_norm and logged_lr == lr_list
+    assert log['phase_time'].shape == (4, len(phases))
+    assert [stats['nfe_forward'] for stats in log['stats']] == [0, 1, 2, 3]
+
+
+def test_gradient_norm():
+    model = nn.Linear(3, 2)
+    model.bias.requires_grad_(False)
+    model(torch.ones(4, 3)).sum().backward()
+
+    # the frozen bias has no gradient and is left out
+    assert torch.allclose(gradient_norm(model), model.weight.grad.norm().reshape(1))
@@ -0,0 +1,192 @@
+import math
+import torch
+from ode_solver import ode_solver
+from loss_plateaued import loss_plateaued
+from training_telemetry import trainingTelemetry, gradient_norm
+
+### Training loop shared by collocation, NODE and multiple shooting training ###
+
+# Loss functions of a prediction and its target, both with dimension (n_members, N, number_of_features),
+# returning the loss of every member (n_members,). Options are passed as keyword arguments (loss_options).
+
+def mae(pred, target):
+    # MAE (L1)
+    return torch.mean(torch.abs(pred - target), dim=(1, 2))
+
+def mse(pred, target):
+    # MSE (L2)
+    return torch.mean((pred - target) ** 2, dim=(1, 2))
+
+def rmse(pred, target):
+    return torch.sqrt(mse(pred, target))
+
+def huber(pred, target, delta=0.03):
+    error = torch.abs(pred - target)
+    return torch.mean(torch.where(error < delta, 0.5 * error ** 2, delta * error - 0.5 * delta ** 2), dim=(1, 2))
+
+def log_cosh(pred, target):
+    # log(cosh(d)) = |d| + log(1 + exp(-2|d|)) - log(2), without the overflow of cosh for large residuals
+    d = torch.abs(pred - target)
+    return torch.mean(d + torch.nn.functional.softplus(-2 * d) - math.log(2), dim=(1, 2))
+
+def mape(pred, target):
+    # mean absolute percentage error, over the non-zero targets
+    mask = target != 0
+    error = torch.where(mask, torch.abs(pred - target) / torch.where(mask, target, torch.ones_like(target)).abs(), torch.zeros_like(target))
+    return torch.sum(error, dim=(1, 2)) / torch.sum(mask, dim=(1, 2)).clamp_min(1)
+
+def scaled_mae(pred, target, scale=1.0):
+    # MAE with scaling, refer to Kim: "stiff NODEs", e.g. scale=ytScale
+    return torch.mean(torch.abs(pred - target) / scale, dim=(1, 2))
+
+loss_functions = {'mae': mae, 'mse': mse, 'rmse': rmse, 'huber': huber, 'logcosh': log_cosh, 'mape': mape, 'scaled_mae': scaled_mae}
+
+
+# Learning rate schedules, the learning rate of iteration it (1 ... n_iters) from the initial one
+
+def step_schedule(ilr, n_iters, gamma=0.5):
+    # halves the learning rate at 20, 40, 50, 60, 70, 80 and 90 % of the iterations
+    lr_adjust = {int(0.2 * n_iters): gamma * ilr, int(0.4 * n_iters): gamma ** 2 * ilr, int(0.5 * n_iters): gamma ** 3 * ilr, int(0.6 * n_iters): gamma ** 4 * ilr,
+                int(0.7 * n_iters): gamma ** 5 * ilr, int(0.8 * n_iters): gamma ** 6 * ilr, int(0.9 * n_iters): gamma ** 7 * ilr}
+    steps = sorted((k, value) for k, value in lr_adjust.items() if k >= 1)
+
+    def lr(it):
+        # the adjustment at iteration k applies from iteration k + 1 on
+        current = ilr
+        for k, value in steps:
+            if it > k:
+                current = value
+        return current
+    return lr
+
+def cosine_schedule(ilr, n_iters, min_lr=1e-4):
+    return lambda it: min_lr + 0.5 * (ilr - min_lr) * (1 + math.cos(math.pi * (it - 1) / max(n_iters - 1, 1)))
+
+def exponential_schedule(ilr, n_iters, final_lr=1e-3):
+    return lambda it: ilr * (final_lr / ilr) ** ((it - 1) / max(n_iters - 1, 1))
+
+def constant_schedule(ilr, n_iters):
+    return lambda it: ilr
+
+schedulers = {'step': step_schedule, 'cosine': cosine_schedule, 'exponential': exponential_schedule, 'constant': constant_schedule}
+
+
+def training_engine(model, sample, forward, n_iters=2000, name='', params=None, ilr=1e-1, loss='mae', loss_options=None,
+    scheduler='step', scheduler_options=None, patience=None, min_delta=1e-2, tol=0.0, validation_fn=None, target_rmse=None,
+    validate_every=100, after_backward=None, log_path=None):
+    """
+    Trains a model with Adam: draws a batch, predicts, and steps on the loss, until n_iters iterations
+    or one of the early stopping criteria.
+
+    Args:
+        model: The model to train, e.g. a neuralODE, an ensembleODE or a hybridODE.
+        sample: A function sample() returning a batch.
+        forward: A function forward(batch) returning the prediction and its target, both with dimension
+            (n_members, N, number_of_features), and optionally a penalty of every member, added to the loss
+            that is minimised but recorded apart from it.
+        n_iters: Maximum number of iterations.
+        name: The name of the training, printed.
+        params: The parameters (groups) to optimise (default: None, model.parameters()).
+        ilr: The initial learning rate.
+        loss: A name of loss_functions ('mae', 'mse', 'rmse', 'huber', 'logcosh', 'mape', 'scaled_mae'),
+            or a function as those, with the options loss_options, e.g. {'delta': 0.03} for 'huber'.
+        scheduler: A name of schedulers ('step', 'cosine', 'exponential', 'constant'), or a function
+            lr(it), with the options scheduler_options.
+        patience, min_delta, tol: Stops once the loss has converged, see loss_plateaued() (default: None, not used).
+        validation_fn: A function validation_fn(model) returning the validation RMSE of every member,
+            e.g. validation_rmse(t, true_y), evaluated every validate_every iterations.
+        target_rmse: Stops once the validation RMSE of all members is at most target_rmse.
+        after_backward: A function after_backward(batch, pred) called after backpropagation, returning
+            the solver statistics of the iteration or None.
+        log_path: Writes the telemetry of the run to this file, see trainingTelemetry (default: None).
+
+    Returns:
+        model, loss_list (the loss without the penalty), grad_norm, lr_list, and the telemetry
+            (e.g. telemetry.stats, telemetry.penalties() and telemetry.summary()).
+    """
+    loss_fn = loss_functions[loss] if isinstance(loss, str) else loss
+    loss_options = loss_options or {}
+    lr_fn = schedulers[scheduler](ilr, n_iters, **(scheduler_options or {})) if isinstance(scheduler, str) else scheduler
+    optimizer = torch.optim.Adam(model.parameters() if params is None else params, lr=lr_fn(1))
+
+    show_all_loss = False
+
+    # an ensembleODE trains its K members in one pass, one loss and gradient norm per member
+    n_members = getattr(model, 'n_members', 1)
+
+    # loss, gradient norm, learning rate and wall time per phase, with log_path also written to disk, see trainingTelemetry
+    telemetry = trainingTelemetry(n_iters, n_members, log_path)
+
+    # Train iteration
+    print("Starting {} training.".format(name))
+
+    for it in range(1, n_iters + 1):
+        model.train(mode=True)
+        optimizer.zero_grad()
+        with telemetry.phase('batching'):
+            batch = sample()
+
+        with telemetry.phase('forward'):
+            output = forward(batch)
+            loss_members = loss_fn(output[0], output[1], **loss_options)
+            penalty = output[2] if len(output) > 2 else None
+            loss = torch.sum(loss_members if penalty is None else loss_members + penalty)
+
+        with telemetry.phase('backward'):
+            loss.backward()
+
+        stats = after_backward(batch, output[0]) if after_backward is not None else None
+
+        # one gradient norm per member, kept on the device
+        total_norm = gradient_norm(model, n_members)
+        lr = optimizer.param_groups[-1]['lr']
+
+        with telemetry.phase('optimizer'):
+            optimizer.step()
+            for param_group in optimizer.param_groups:
+                param_group['lr'] = lr_fn(it + 1)
+
+        telemetry.record(loss_members, total_norm, lr, stats, penalty)
+
+        if patience is not None and loss_plateaued(telemetry.losses(), patience, min_delta, tol):
+            print('Converged at iteration: ', it, '/', n_iters)
+            break
+
+        if validation_fn is not None and target_rmse is not None and it % validate_every == 0:
+            val_rmse = validation_fn(model)
+            if torch.all(val_rmse <= target_rmse):
+                print('Reached the target RMSE at iteration: ', it, '/', n_iters)
+                break
+
+        if show_all_loss:
+            print('Iter {:04d} | Loss {:.7f}'.format(it, loss.item()))
+        else:
+            if it % 250 == 0:
+                print('Iteration: ', it, '/', n_iters)
+
+    loss_list, grad_norm, lr_list = telemetry.close()
+    print('Wall time per phase (s): ' + ', '.join('{} {:.1f}'.format(phase, time) for phase, time in telemetry.summary().items()))
+    return model, loss_list, grad_norm, lr_list, telemetry
+
+
+def validation_rmse(t, true_y, solver='dopri5'):
+    """
+    Returns a function of the model giving the RMSE of its prediction of true_y from true_y[0], one per member,
+    e.g. as validation_fn of training_engine().
+
+    Args:
+        t: A torch list of ascending time points.
+        true_y: A torch tensor with dimension (length(t), 1, number_of_features),
+            or (length(t), number_of_trajectories, number_of_features).
+        solver: The solver name, see ode_solver().
+    """
+    nf = true_y.size(dim=true_y.ndim-1)
+    y = true_y.reshape(len(t), -1, nf)
+
+    def rmse_fn(model):
+        n_members = getattr(model, 'n_members', 1)
+        model.eval()
+        with torch.no_grad():
+            pred_y = ode_solver(model, y[0].view(-1, 1, nf).repeat(n_members, 1, 1), t, method=solver).view(len(t), n_members, -1, nf)
+        return torch.sqrt(torch.mean((pred_y - y.unsqueeze(1)) ** 2, dim=(0, 2, 3)))
+    return rmse_fn
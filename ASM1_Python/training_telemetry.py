@@ -0,0 +1,145 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+import torch
+
+### Training telemetry in preallocated buffers, written to disk in the background ###
+
+phases = ('batching', 'forward', 'backward', 'optimizer')
+
+
+class trainingTelemetry:
+
+    def __init__(self, n_iters, n_members=1, log_path=None, flush_every=250):
+        """
+        Records loss, gradient norm, learning rate, wall time per phase, solver statistics and the penalty
+        of a regulariser of a training run.
+
+        Loss and gradient norm stay tensors on the device of the model until the end of the run, so recording
+        them does not wait for the device. With log_path, a snapshot of the records is written every
+        flush_every iterations by a background thread, read back by load_telemetry() or plot_loss_grad(log_path).
+
+        Args:
+            n_iters: Maximum number of iterations.
+            n_members: Number of members of an ensembleODE, one loss and gradient norm per member.
+            log_path: The log file (default: None, not written).
+            flush_every: Number of iterations between two snapshots.
+        """
+        self.n_members = n_members
+        self.loss = torch.zeros(n_iters, n_members)
+        self.grad_norm = torch.zeros(n_iters, n_members)
+        self.penalty = torch.zeros(n_iters, n_members)
+        self.lr = np.zeros(n_iters)
+        self.phase_time = np.zeros((n_iters, len(phases)))
+        self.stats = []
+        self.n = 0  # number of iterations recorded
+
+        self.log_path = log_path
+        self.flush_every = flush_every
+        self.writer = ThreadPoolExecutor(max_workers=1) if log_path is not None else None
+        self.pending = None
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Adds the wall time of the enclosed block to phase name of the current iteration.
+        """
+        start = time.perf_counter()
+        yield
+        self.phase_time[self.n, phases.index(name)] += time.perf_counter() - start
+
+    def record(self, loss, grad_norm, lr, stats=None, penalty=None):
+        """
+        Records one iteration: the loss and gradient norm (of every member), the learning rate and
+        optionally a dict of solver statistics and the penalty (of every member) added to the loss.
+        """
+        if self.loss.device != loss.device:
+            self.loss, self.grad_norm, self.penalty = self.loss.to(loss.device), self.grad_norm.to(loss.device), self.penalty.to(loss.device)
+        self.loss[self.n] = loss.detach()
+        self.grad_norm[self.n] = grad_norm
+        if penalty is not None:
+            self.penalty[self.n] = penalty.detach()
+        self.lr[self.n] = lr
+        if stats is not None:
+            self.stats.append(stats)
+        self.n += 1
+
+        if self.writer is not None and self.n % self.flush_every == 0:
+            self.flush()
+
+    def losses(self):
+        # the recorded losses as a numpy array (iterations, members), e.g. for loss_plateaued()
+        return self.loss[:self.n].cpu().numpy()
+
+    def penalties(self):
+        # the recorded penalties, one number per iteration, or a list per iteration for an ensemble
+        penalty = self.penalty[:self.n].cpu()
+        return penalty[:, 0].tolist() if self.n_members == 1 else penalty.tolist()
+
+    def snapshot(self):
+        return {'loss': self.loss[:self.n].cpu().clone(), 'grad_norm': self.grad_norm[:self.n].cpu().clone(),
+                'penalty': self.penalty[:self.n].cpu().clone(),
+                'lr': torch.from_numpy(self.lr[:self.n].copy()), 'phase_time': torch.from_numpy(self.phase_time[:self.n].copy()), 'phases': phases,
+                'stats': list(self.stats)}
+
+    def flush(self):
+        # skipped while the previous snapshot is still being written, the next one catches up
+        if self.pending is not None and not self.pending.done():
+            return
+        self.pending = self.writer.submit(save_telemetry, self.log_path, self.snapshot())
+
+    def close(self):
+        """
+        Writes the final snapshot, and returns loss_list, grad_norm, lr_list as the training functions:
+        one number per iteration, or a list per iteration for an ensemble.
+        """
+        if self.writer is not None:
+            if self.pending is not None:
+                self.pending.result()
+            self.writer.submit(save_telemetry, self.log_path, self.snapshot()).result()
+            self.writer.shutdown()
+            self.writer = None
+        return as_lists(self.loss[:self.n].cpu(), self.grad_norm[:self.n].cpu(), self.lr[:self.n])
+
+    def summary(self):
+        """
+        Returns the total wall time of every phase, in seconds.
+        """
+        return dict(zip(phases, np.sum(self.phase_time[:self.n], axis=0).tolist()))
+
+
+def save_telemetry(path, snapshot):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    torch.save(snapshot, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def as_lists(loss, grad_norm, lr):
+    if loss.size(dim=1) == 1:
+        return loss[:, 0].tolist(), grad_norm[:, 0].tolist(), lr.tolist()
+    return loss.tolist(), grad_norm.tolist(), lr.tolist()
+
+
+def load_telemetry(path):
+    """
+    Reads a log written by trainingTelemetry.
+
+    Returns:
+        loss_list, grad_norm, lr_list: As returned by the training functions.
+        log: The whole log, with the wall time per phase of every iteration ('phase_time', in the order of
+            'phases'), the penalty of a regulariser ('penalty') and the solver statistics ('stats').
+    """
+    log = torch.load(path)
+    return (*as_lists(log['loss'], log['grad_norm'], log['lr']), log)
+
+
+def gradient_norm(model, n_members=1):
+    """
+    Returns the 2-norm of the gradient of every member as a tensor (n_members,), without copying
+    it to the host. The stacked weights of an ensemble hold the member as first dimension; frozen
+    parameters, e.g. of a hybridODE, have no gradient.
+    """
+    norms = [p.grad.detach().view(n_members, -1).norm(2, dim=1) for p in model.parameters() if p.grad is not None]
+    return torch.linalg.vector_norm(torch.stack(norms), dim=0)
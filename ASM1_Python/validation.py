@@ -1,16 +1,28 @@
 ### Validation ###
 import torch
-from torchdiffeq import odeint
-# from torchdiffeq import odeint_adjoint as odeint # for adjoint method!
+from ode_solver import ode_solver
+from solver_stats import instrumentedODE, stiffness_ratio
 
 def validation(model, t, 
     true_y0 = torch.tensor([[20.2, 59.8, 58.8, 260.1, 2552.0, 148, 449, 2, 0, 23.0, 1.8, 7.8, 0.007, 0, 35]]),
-    solver='dopri5'):
+    solver='dopri5', rtol=None, atol=None, solver_stats=False, stiffness=False):
     print('Starting testing...')
     noFeature = true_y0.size(dim=true_y0.ndim-1)
+    # an ensembleODE predicts the same initial condition with each member, giving (length(t), K, noFeature)
+    n_members = getattr(model, 'n_members', 1)
     model.eval()
+    # with solver_stats=True the solver work is returned after pred_y, and with stiffness=True
+    # also the stiffness ratio and largest eigenvalue along the prediction, with dimension (length(t), K)
+    ode_func = instrumentedODE(model) if solver_stats else model
+    # rtol, atol: the tolerances of the solver (default: None, its own, see ode_solver())
     with torch.no_grad():
-        pred_y = odeint(model, true_y0.view(1, 1, noFeature), t, method=solver).view(-1, 1, noFeature)
+        pred_y = ode_solver(ode_func, true_y0.view(1, 1, noFeature).repeat(n_members, 1, 1), t, method=solver, rtol=rtol, atol=atol).view(-1, n_members, noFeature)
 
     print('testing end')
+    if solver_stats:
+        stats = ode_func.statistics()
+        if stiffness:
+            ratio, max_eigenvalue = stiffness_ratio(model, t, pred_y.transpose(0, 1))
+            stats['stiffness_ratio'], stats['max_eigenvalue'] = ratio.view(n_members, -1).T, max_eigenvalue.view(n_members, -1).T
+        return pred_y, stats
     return pred_y
\ No newline at end of file